@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
 import sys
 import logging
 
@@ -10,50 +11,25 @@ if frozen:
 else:
     logging.basicConfig(level=logging.DEBUG)
 
-try:
-    import xml.etree.cElementTree as et
-except ImportError:
-    import xml.etree.ElementTree as et
-
 import os
-import re
 
 from .qt import *
 from . import utils
+from .automaton import Automaton, load_automatons, save_automatons, \
+    MODE_MANUAL, MODE_WATCH_FILES, MODE_WATCH_FOLDER, MODE_TIMER, MODE_WATCH_FILE_EVENTS
+from .engine import get_engine
+from .kernels import get_kernel_pool
+from .export import get_export_pipeline, EXPORT_FORMATS
+from .settings import get_settings, apply_settings
 from .translate import tr
-
-from datetime import datetime, timedelta
-import traceback
-
-VERSION_STRING = '0.0.1'
+from .logview import LogModel, LogHandler, LogView
+from .automatonlist import AutomatonListModel, DISPLAY_ROLE
+from .runlog import install_run_log, shutdown_run_log
+from .watchers import BACKEND_AUTO, BACKEND_INOTIFY, BACKEND_POLLING
+from .selection import FileSelector, SORT_NONE, SORT_NAME, SORT_MTIME, SORT_SIZE
+from . import startup
 
 from pyqtconfig import ConfigManager
-import os
-import sys
-import time
-
-try:
-    from IPython.kernel import KernelManager
-except ImportError:
-    from IPython.zmq.blockingkernelmanager import BlockingKernelManager as KernelManager
-
-from IPython.nbformat.current import reads, NotebookNode
-from IPython.nbconvert.exporters import export as IPyexport
-from IPython.nbconvert.exporters.export import exporter_map as IPyexporter_map
-
-from IPython.utils.ipstruct import Struct
-from runipy.notebook_runner import NotebookRunner
-
-_w = None
-
-MODE_MANUAL = 0
-MODE_WATCH_FILES = 1
-MODE_WATCH_FOLDER = 2
-MODE_TIMER = 3
-
-
-class NotebookNotFound(Exception):
-    pass
 
 
 def mkdir_p(path):
@@ -66,43 +42,6 @@ def mkdir_p(path):
             raise
 
 
-class Logger(logging.Handler):
-    def __init__(self, parent, widget, out=None, color=None):
-        super(Logger, self).__init__()
-        self.m = parent
-        """(edit, out=None, color=None) -> can write stdout, stderr to a
-        QTextEdit.
-        edit = QTextEdit
-        out = alternate stream ( can be the original sys.stdout )
-        color = alternate color (i.e. color stderr a different color)
-        """
-        self.widget = widget
-        self.out = None
-        self.color = color
-
-    def emit(self, record):
-        msg = self.format(record)
-
-        color = {
-            logging.CRITICAL: QColor(164, 0, 0, 50),
-            logging.ERROR: QColor(239, 41, 41, 50),
-            logging.WARNING: QColor(252, 233, 79, 50),
-            logging.INFO: QColor(0, 0, 0, 255),
-            logging.DEBUG: QColor(114, 159, 207, 50),
-            logging.NOTSET: QColor(0, 0, 0, 255),
-        }[record.levelno]
-
-        rows = self.widget._current_rows
-        if rows:
-            rows = rows[-50:]
-        rows.append('<pre style="color:%s;">%s</pre>' % ( color.name(), msg.replace('\n','<br />') ) )
-        self.widget._current_rows = rows
-        self.widget.setHtml('<html><body>' + '\n\n\n'.join(rows) + '</body></html>')
-        
-    def write(self, m):
-        pass
-
-
 # Generic configuration dialog handling class
 class GenericDialog(QDialog):
     '''
@@ -144,9 +83,23 @@ class AutomatonDialog(GenericDialog):
         'Manual': MODE_MANUAL,
         'Watch files': MODE_WATCH_FILES,
         'Watch folder': MODE_WATCH_FOLDER,
+        'Each new file in folder': MODE_WATCH_FILE_EVENTS,
         'Timer': MODE_TIMER,
     }
 
+    backend_options = {
+        'Automatic': BACKEND_AUTO,
+        'inotify (Linux)': BACKEND_INOTIFY,
+        'Polling': BACKEND_POLLING,
+    }
+
+    sort_options = {
+        'Name': SORT_NAME,
+        'Last modified': SORT_MTIME,
+        'Size': SORT_SIZE,
+        'Folder order': SORT_NONE,
+    }
+
     def __init__(self, parent, **kwargs):
         super(AutomatonDialog, self).__init__(parent, **kwargs)
         self.setWindowTitle("Edit Automaton")
@@ -182,6 +135,29 @@ class AutomatonDialog(GenericDialog):
         fwatcher_hold_sb.setSuffix(' secs')
         self.config.add_handler('trigger_hold', fwatcher_hold_sb)
         grid.addWidget(fwatcher_hold_sb, 1, 1)
+
+        max_hold_sb = QSpinBox()
+        max_hold_sb.setRange(0, 3600)
+        max_hold_sb.setPrefix('at most ')
+        max_hold_sb.setSpecialValueText('no limit')
+        max_hold_sb.setSuffix(' secs')
+        max_hold_sb.setStatusTip('Run after this long even if changes keep arriving')
+        self.config.add_handler('trigger_max_hold', max_hold_sb)
+        grid.addWidget(max_hold_sb, 1, 2)
+
+        grid.addWidget(QLabel('Wait for files'), 2, 0)
+        stable_quiet_sb = QSpinBox()
+        stable_quiet_sb.setRange(0, 3600)
+        stable_quiet_sb.setSpecialValueText('no quiet period')
+        stable_quiet_sb.setSuffix(' secs unchanged')
+        stable_quiet_sb.setStatusTip('Only use a changed file once it has stopped changing for this long')
+        self.config.add_handler('stable_quiet', stable_quiet_sb)
+        grid.addWidget(stable_quiet_sb, 2, 1)
+
+        stable_on_close_cb = QCheckBox('or closed after writing')
+        stable_on_close_cb.setStatusTip('Use a file as soon as the program writing it closes it; with no quiet period, only then (Linux folders)')
+        self.config.add_handler('stable_on_close', stable_on_close_cb)
+        grid.addWidget(stable_on_close_cb, 2, 2)
         gb.setLayout(grid)
 
         self.layout.addWidget(gb)
@@ -206,6 +182,19 @@ class AutomatonDialog(GenericDialog):
         self.config.add_handler('watch_window', watch_window_sb)
         grid.addWidget(watch_window_sb, 1, 1)
 
+        watch_require_sb = QSpinBox()
+        watch_require_sb.setRange(0, 9999)
+        watch_require_sb.setPrefix('once ')
+        watch_require_sb.setSuffix(' have changed')
+        watch_require_sb.setSpecialValueText('once all have changed')
+        self.config.add_handler('watch_require', watch_require_sb)
+        grid.addWidget(watch_require_sb, 1, 2)
+
+        compare_contents_cb = QCheckBox('Only when contents change')
+        compare_contents_cb.setStatusTip('Ignore saves that leave a file unchanged, and changes of timestamp or permissions')
+        self.config.add_handler('watch_compare_contents', compare_contents_cb)
+        grid.addWidget(compare_contents_cb, 2, 0, 1, 2)
+
         self.watchfile_gb.setLayout(grid)
         self.layout.addWidget(self.watchfile_gb)
 
@@ -222,15 +211,126 @@ class AutomatonDialog(GenericDialog):
         watched_path_btn.clicked.connect(lambda: self.onFolderBrowse(watched_path_le))
         grid.addWidget(watched_path_btn, 0, 3, 1, 1)
 
+        grid.addWidget(QLabel('Include subfolders'), 1, 0)
+        watch_depth_sb = QSpinBox()
+        watch_depth_sb.setRange(-1, 99)
+        watch_depth_sb.setSpecialValueText('All levels')
+        watch_depth_sb.setSuffix(' levels')
+        self.config.add_handler('watch_depth', watch_depth_sb)
+        grid.addWidget(watch_depth_sb, 1, 1)
+
+        grid.addWidget(QLabel('Watch using'), 2, 0)
+        watch_backend_cb = QComboBox()
+        watch_backend_cb.addItems(self.backend_options.keys())
+        self.config.add_handler('watch_backend', watch_backend_cb, mapper=self.backend_options)
+        grid.addWidget(watch_backend_cb, 2, 1)
+
+        watch_poll_sb = QSpinBox()
+        watch_poll_sb.setRange(1, 3600)
+        watch_poll_sb.setPrefix('poll every ')
+        watch_poll_sb.setSuffix(' secs')
+        self.config.add_handler('watch_poll_interval', watch_poll_sb)
+        grid.addWidget(watch_poll_sb, 2, 2)
+
         grid.addWidget(QLabel('Iterate files in folder'), 3, 0)
         loop_folder_sb = QCheckBox()
         self.config.add_handler('iterate_watched_folder', loop_folder_sb)
         grid.addWidget(loop_folder_sb, 3, 1)
 
         loop_wildcard_le = QLineEdit()
+        loop_wildcard_le.setStatusTip('File name patterns, e.g. *.csv;*.txt')
         self.config.add_handler('iterate_wildcard', loop_wildcard_le)
         grid.addWidget(loop_wildcard_le, 3, 2)
 
+        grid.addWidget(QLabel('Exclude'), 4, 0)
+        exclude_le = QLineEdit()
+        exclude_le.setStatusTip('Names or subfolder paths to skip, e.g. *.bak;archive/*')
+        self.config.add_handler('iterate_exclude', exclude_le)
+        grid.addWidget(exclude_le, 4, 1, 1, 2)
+
+        grid.addWidget(QLabel('Path regex'), 5, 0)
+        regex_le = QLineEdit()
+        regex_le.setStatusTip('Regular expression searched for in the path relative to the folder')
+        self.config.add_handler('iterate_regex', regex_le)
+        grid.addWidget(regex_le, 5, 1, 1, 2)
+
+        grid.addWidget(QLabel('File size'), 6, 0)
+        min_size_sb = QSpinBox()
+        min_size_sb.setRange(0, 2 ** 30)
+        min_size_sb.setPrefix('min ')
+        min_size_sb.setSuffix(' KB')
+        self.config.add_handler('iterate_min_size', min_size_sb)
+        grid.addWidget(min_size_sb, 6, 1)
+
+        max_size_sb = QSpinBox()
+        max_size_sb.setRange(0, 2 ** 30)
+        max_size_sb.setSpecialValueText('no maximum')
+        max_size_sb.setPrefix('max ')
+        max_size_sb.setSuffix(' KB')
+        self.config.add_handler('iterate_max_size', max_size_sb)
+        grid.addWidget(max_size_sb, 6, 2)
+
+        grid.addWidget(QLabel('Modified within'), 7, 0)
+        max_age_sb = QSpinBox()
+        max_age_sb.setRange(0, 24 * 365)
+        max_age_sb.setSpecialValueText('any time')
+        max_age_sb.setSuffix(' hours')
+        self.config.add_handler('iterate_max_age', max_age_sb)
+        grid.addWidget(max_age_sb, 7, 1)
+
+        grid.addWidget(QLabel('Order by'), 8, 0)
+        sort_cb = QComboBox()
+        sort_cb.addItems(self.sort_options.keys())
+        self.config.add_handler('iterate_sort', sort_cb, mapper=self.sort_options)
+        grid.addWidget(sort_cb, 8, 1)
+
+        sort_reverse_cb = QCheckBox('Descending')
+        self.config.add_handler('iterate_sort_reverse', sort_reverse_cb)
+        grid.addWidget(sort_reverse_cb, 8, 2)
+
+        grid.addWidget(QLabel('At most'), 9, 0)
+        limit_sb = QSpinBox()
+        limit_sb.setRange(0, 2 ** 30)
+        limit_sb.setSpecialValueText('all files')
+        limit_sb.setSuffix(' files')
+        self.config.add_handler('iterate_limit', limit_sb)
+        grid.addWidget(limit_sb, 9, 1)
+
+        grid.addWidget(QLabel('Run files in parallel'), 10, 0)
+        parallel_cb = QCheckBox()
+        self.config.add_handler('iterate_parallel', parallel_cb)
+        grid.addWidget(parallel_cb, 10, 1)
+
+        parallel_limit_sb = QSpinBox()
+        parallel_limit_sb.setRange(1, 256)
+        parallel_limit_sb.setSuffix(' workers')
+        self.config.add_handler('iterate_parallel_limit', parallel_limit_sb)
+        grid.addWidget(parallel_limit_sb, 10, 2)
+
+        grid.addWidget(QLabel('Only new or changed files'), 11, 0)
+        incremental_cb = QCheckBox()
+        self.config.add_handler('iterate_incremental', incremental_cb)
+        grid.addWidget(incremental_cb, 11, 1)
+
+        incremental_hash_cb = QCheckBox('Compare contents')
+        self.config.add_handler('incremental_hash', incremental_hash_cb)
+        grid.addWidget(incremental_hash_cb, 11, 2)
+
+        grid.addWidget(QLabel('Run setup cells once'), 12, 0)
+        batch_setup_cb = QCheckBox()
+        batch_setup_cb.setStatusTip('Cells tagged "setup" run once per kernel; the rest run for every file')
+        self.config.add_handler('batch_setup', batch_setup_cb)
+        grid.addWidget(batch_setup_cb, 12, 1)
+
+        self.event_concurrency_label = QLabel('Files at once')
+        grid.addWidget(self.event_concurrency_label, 13, 0)
+        self.event_concurrency_sb = QSpinBox()
+        self.event_concurrency_sb.setRange(1, 256)
+        self.event_concurrency_sb.setSuffix(' runs')
+        self.event_concurrency_sb.setStatusTip('Each new file is run on its own; up to this many at a time')
+        self.config.add_handler('event_concurrency', self.event_concurrency_sb)
+        grid.addWidget(self.event_concurrency_sb, 13, 1)
+
         self.watchfolder_gb.setLayout(grid)
         self.layout.addWidget(self.watchfolder_gb)
 
@@ -253,6 +353,27 @@ class AutomatonDialog(GenericDialog):
         self.manual_gb.setLayout(grid)
         self.layout.addWidget(self.manual_gb)
 
+        gb = QGroupBox('Cache')
+        grid = QGridLayout()
+        cache_cells_cb = QCheckBox('Reuse cell outputs when nothing has changed')
+        self.config.add_handler('cache_cells', cache_cells_cb)
+        grid.addWidget(cache_cells_cb, 0, 0, 1, 3)
+
+        grid.addWidget(QLabel('Input files'), 1, 0)
+        cache_inputs_le = QLineEdit()
+        cache_inputs_le.setStatusTip('Files read by the notebook; a change to any of them re-runs it')
+        self.config.add_handler('cache_inputs', cache_inputs_le, mapper=(lambda x: x.split(";"), lambda x: ";".join(x)))
+        grid.addWidget(cache_inputs_le, 1, 1)
+
+        cache_inputs_btn = QToolButton()
+        cache_inputs_btn.setIcon(QIcon(os.path.join(utils.scriptdir, 'icons', 'document-copy.png')))
+        cache_inputs_btn.setStatusTip('Add file(s)')
+        cache_inputs_btn.clicked.connect(self.onCacheInputsBrowse)
+        grid.addWidget(cache_inputs_btn, 1, 2)
+        gb.setLayout(grid)
+
+        self.layout.addWidget(gb)
+
         gb = QGroupBox('Output')
         grid = QGridLayout()
         output_path_le = QLineEdit()
@@ -265,11 +386,15 @@ class AutomatonDialog(GenericDialog):
         grid.addWidget(notebook_path_btn, 0, 2, 1, 1)
 
         export_cb = QComboBox()
-        export_cb.addItems(IPyexporter_map.keys())
+        export_cb.addItems(EXPORT_FORMATS)
         self.config.add_handler('output_format', export_cb)
         grid.addWidget(QLabel('Notebook output format'), 1, 0)
         grid.addWidget(export_cb, 1, 1)
 
+        strip_outputs_cb = QCheckBox('Discard outputs saved in the notebook before running')
+        self.config.add_handler('strip_outputs', strip_outputs_cb)
+        grid.addWidget(strip_outputs_cb, 2, 0, 1, 2)
+
         gb.setLayout(grid)
 
         self.layout.addWidget(gb)
@@ -280,342 +405,212 @@ class AutomatonDialog(GenericDialog):
         self.onChangeMode(mode_cb.currentIndex())
 
     def onNotebookBrowse(self, t):
-        global _w
-        filenames, _ = QFileDialog.getOpenFileNames(_w, "Load IPython notebook(s)", '', "IPython Notebooks (*.ipynb);;All files (*.*)")
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Load IPython notebook(s)", '', "IPython Notebooks (*.ipynb);;All files (*.*)")
         if filenames:
             self.config.set('notebook_paths', filenames)
 
     def onFolderBrowse(self, t):
-        global _w
-        filename = QFileDialog.getExistingDirectory(_w, "Select folder to watch")
+        filename = QFileDialog.getExistingDirectory(self, "Select folder to watch")
         if filename:
             self.config.set('watched_folder', filename)
 
     def onFilesBrowse(self, t):
-        global _w
-        filenames, _ = QFileDialog.getOpenFileNames(_w, "Select file(s) to watch")
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Select file(s) to watch")
         if filenames:
             self.config.set('watched_files', filenames)
         
+    def onCacheInputsBrowse(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Select notebook input file(s)")
+        if filenames:
+            self.config.set('cache_inputs', filenames)
+
     def onChangeMode(self, i):
+        mode = list(self.mode_options.items())[i][1]
+        # Per-file runs share the folder options
+        shown = MODE_WATCH_FOLDER if mode == MODE_WATCH_FILE_EVENTS else mode
         for m, gb in {MODE_MANUAL: self.manual_gb, MODE_WATCH_FILES: self.watchfile_gb, MODE_WATCH_FOLDER: self.watchfolder_gb, MODE_TIMER: self.timer_gb}.items():
-            if m == list(self.mode_options.items())[i][1]:
+            if m == shown:
                 gb.show()
             else:
                 gb.hide()
+
+        self.event_concurrency_label.setVisible(mode == MODE_WATCH_FILE_EVENTS)
+        self.event_concurrency_sb.setVisible(mode == MODE_WATCH_FILE_EVENTS)
         
+    def accept(self):
+        # Patterns are compiled when files are selected; catch mistakes while they can still be corrected
+        try:
+            FileSelector(
+                self.config.get('iterate_wildcard'), self.config.get('iterate_regex'), self.config.get('iterate_exclude'))
+        except re.error as e:
+            QMessageBox.warning(self, "Invalid pattern", "The file selection patterns are not valid: %s" % e)
+            return
+
+        super(AutomatonDialog, self).accept()
+
     def sizeHint(self):
         return QSize(400, 200)
 
 
-class AutomatonListDelegate(QAbstractItemDelegate):
+class PreferencesDialog(GenericDialog):
 
-    def paint(self, painter, option, index):
-        # GET TITLE, DESCRIPTION AND ICON
-        ic = QIcon(index.data(Qt.DecorationRole))
-        automaton = index.data(Qt.UserRole)
-
-        f = QFont()
-        f.setPointSize(10)
-        painter.setFont(f)
-
-        if automaton.is_running:
-            painter.setPen(QPalette().text().color())
-            painter.fillRect(option.rect, QBrush(QColor(0, 255, 0, 50)))
-        elif automaton.latest_run['success'] == False:
-            painter.setPen(QPalette().text().color())
-            painter.fillRect(option.rect, QBrush(QColor(255, 0, 0, 50)))
-        elif option.state & QStyle.State_Selected:
-            painter.setPen(QPalette().highlightedText().color())
-            painter.fillRect(option.rect, QBrush(QPalette().highlight().color()))
-        else:
-            painter.setPen(QPalette().text().color())
-        
-        r = QRect(5, 4, 12, 12)
-        r.translate(option.rect.x(), option.rect.y())
-        icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'document-attribute-i-sm.png'))
-        painter.drawPixmap(r, icn.pixmap(QSize(12, 12)))
-
-        r = QRect(5, 36, 12, 12)
-        r.translate(option.rect.x(), option.rect.y())
-        icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'disk-sm.png'))
-        painter.drawPixmap(r, icn.pixmap(QSize(12, 12)))
-        #r = option.rect.adjusted(26, 5, 0, 0)
-
-        pen = QPen()
-        if automaton.config.get('is_active'):
-            pen.setColor(QColor('black'))
-        else:
-            pen.setColor(QColor('#aaaaaa'))
+    def __init__(self, parent, **kwargs):
+        super(PreferencesDialog, self).__init__(parent, **kwargs)
+        self.setWindowTitle("Preferences")
 
-        painter.setPen(pen)
+        self.config = ConfigManager()
 
-        # NOTEBOOK
-        r = QRect(20, 4, option.rect.width() - 40, 20)
-        r.translate(option.rect.x(), option.rect.y())
-        painter.drawText(r, Qt.AlignLeft, ";".join(automaton.config.get('notebook_paths')))
+        gb = QGroupBox('Execution')
+        grid = QGridLayout()
+        grid.addWidget(QLabel('Concurrent runs'), 0, 0)
+        max_concurrent_sb = QSpinBox()
+        max_concurrent_sb.setRange(1, 256)
+        self.config.add_handler('max_concurrent_runs', max_concurrent_sb)
+        grid.addWidget(max_concurrent_sb, 0, 1)
+        gb.setLayout(grid)
 
-        # OUTPUT
-        r = QRect(20, 36, option.rect.width() - 40, 20)
-        r.translate(option.rect.x(), option.rect.y())
-        painter.drawText(r, Qt.AlignLeft, automaton.config.get('output_path'))
+        self.layout.addWidget(gb)
 
-        # WATCH PATH
-        r = QRect(20, 20, option.rect.width() - 40, 20)
-        r.translate(option.rect.x(), option.rect.y())
-        if automaton.config.get('mode') == MODE_WATCH_FILES:
-            painter.drawText(r, Qt.AlignLeft, ";".join(automaton.config.get('watched_files')))
-            icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'document-copy-sm.png'))
+        gb = QGroupBox('Kernel pool')
+        grid = QGridLayout()
+        grid.addWidget(QLabel('Warm kernels'), 0, 0)
+        min_kernels_sb = QSpinBox()
+        min_kernels_sb.setRange(0, 256)
+        self.config.add_handler('min_kernels', min_kernels_sb)
+        grid.addWidget(min_kernels_sb, 0, 1)
+
+        grid.addWidget(QLabel('Maximum kernels'), 1, 0)
+        max_kernels_sb = QSpinBox()
+        max_kernels_sb.setRange(1, 256)
+        self.config.add_handler('max_kernels', max_kernels_sb)
+        grid.addWidget(max_kernels_sb, 1, 1)
+
+        grid.addWidget(QLabel('Shut down idle kernels after'), 2, 0)
+        kernel_idle_sb = QSpinBox()
+        kernel_idle_sb.setRange(0, 86400)
+        kernel_idle_sb.setSuffix(' secs')
+        self.config.add_handler('kernel_idle_timeout', kernel_idle_sb)
+        grid.addWidget(kernel_idle_sb, 2, 1)
+        gb.setLayout(grid)
 
-        elif automaton.config.get('mode') == MODE_WATCH_FOLDER:
-            painter.drawText(r, Qt.AlignLeft, automaton.config.get('watched_folder'))
-            icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'folder-horizontal-open-sm.png'))
+        self.layout.addWidget(gb)
 
-        elif automaton.config.get('mode') == MODE_TIMER:
-            painter.drawText(r, Qt.AlignLeft, "%s seconds(s)" % automaton.config.get('timer_seconds'))
-            icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'clock-select-sm.png'))
+        gb = QGroupBox('Cell cache')
+        grid = QGridLayout()
+        grid.addWidget(QLabel('Maximum size'), 0, 0)
+        cell_cache_sb = QSpinBox()
+        cell_cache_sb.setRange(1, 1024 * 1024)
+        cell_cache_sb.setSuffix(' MB')
+        self.config.add_handler('cell_cache_size', cell_cache_sb)
+        grid.addWidget(cell_cache_sb, 0, 1)
+        gb.setLayout(grid)
 
-        elif automaton.config.get('mode') == MODE_MANUAL:
-            icn = QIcon(os.path.join(utils.scriptdir, 'icons', 'hand-finger-sm.png'))
+        self.layout.addWidget(gb)
 
-        r = QRect(5, 20, 12, 12)
-        r.translate(option.rect.x(), option.rect.y())
-        painter.drawPixmap(r, icn.pixmap(QSize(12, 12)))
+        gb = QGroupBox('Log')
+        grid = QGridLayout()
+        grid.addWidget(QLabel('Keep'), 0, 0)
+        log_retention_sb = QSpinBox()
+        log_retention_sb.setRange(100, 10000000)
+        log_retention_sb.setSingleStep(1000)
+        log_retention_sb.setSuffix(' lines')
+        self.config.add_handler('log_retention', log_retention_sb)
+        grid.addWidget(log_retention_sb, 0, 1)
+
+        grid.addWidget(QLabel('Rotate run logs at'), 1, 0)
+        run_log_size_sb = QSpinBox()
+        run_log_size_sb.setRange(1, 1024)
+        run_log_size_sb.setSuffix(' MB')
+        self.config.add_handler('run_log_size', run_log_size_sb)
+        grid.addWidget(run_log_size_sb, 1, 1)
+
+        grid.addWidget(QLabel('Remove run logs after'), 2, 0)
+        run_log_keep_sb = QSpinBox()
+        run_log_keep_sb.setRange(1, 3650)
+        run_log_keep_sb.setSuffix(' days')
+        self.config.add_handler('run_log_keep_days', run_log_keep_sb)
+        grid.addWidget(run_log_keep_sb, 2, 1)
+        gb.setLayout(grid)
 
+        self.layout.addWidget(gb)
 
-        # LATEST RUN
-        if automaton.latest_run['timestamp']:
-            r = QRect(5, 52, option.rect.width() - 10, 20)
-            r.translate(option.rect.x(), option.rect.y())
-            painter.drawText(r, Qt.AlignLeft, "Latest run: %s" % automaton.latest_run['timestamp'].strftime("%Y-%m-%d %H:%M:%S"))
-            # r = option.rect.adjusted(100, 40, 0, 0)
-            # painter.drawText(r.left(), r.top(), r.width(), r.height(), Qt.AlignLeft, automaton.latest_run['datetime'].strftime("%Y-%m-%d %H:%M:%S"))
+        self.layout.addStretch()
+        self.finalise()
 
-    def sizeHint(self, option, index):
-        return QSize(200, 70)
+    def sizeHint(self):
+        return QSize(300, 200)
 
 
-class Automaton(QStandardItem):
+_pixmaps = {}
 
-    def __init__(self, *args, **kwargs):
-        super(Automaton, self).__init__(*args, **kwargs)
 
-        self.setData(self, Qt.UserRole)
-        self.watcher = QFileSystemWatcher()
-        self.timer = QTimer()
+def icon_pixmap(name, size=12):
+    # Loaded from disk once per process
+    key = (name, size)
+    if key not in _pixmaps:
+        _pixmaps[key] = QIcon(os.path.join(utils.scriptdir, 'icons', name)).pixmap(QSize(size, size))
+    return _pixmaps[key]
 
-        self.watch_window = {}
 
-        self.latest_run = {}
-        self.is_running = False
+class AutomatonListDelegate(QAbstractItemDelegate):
 
-        self.config = ConfigManager()
-        self.config.set_defaults({
-            'mode': MODE_WATCH_FOLDER,
-            'is_active': True,
-            'trigger_hold': 1,
-            'notebook_paths': '',
-            'output_path': '{home}/{notebook_filename}_{datetime}_',
-            'output_format': 'html',
-
-            'watched_files': [],
-            'watched_folder': '',
-            'watch_window': 15,
-
-            'iterate_watched_folder': True,
-            'iterate_wildcard': '.csv',
-
-            'timer_seconds': 60,
-        })
-
-        self.runner = None
-        self.lock = None
-
-        self.latest_run = {
-            'timestamp': None,
-            'success': None,
-        }
+    def __init__(self, *args, **kwargs):
+        super(AutomatonListDelegate, self).__init__(*args, **kwargs)
 
-        # Set up all the triggers
-        self.watcher.fileChanged.connect(self.file_trigger_accumulator)
-        self.watcher.directoryChanged.connect(self.trigger)
-        self.timer.timeout.connect(self.trigger)
+        self.font = QFont()
+        self.font.setPointSize(10)
+        self.metrics = QFontMetrics(self.font)
 
-    def startup(self):
-        if self.config.get('is_active') == False:
-            return False
-    
-        if self.config.get('mode') == MODE_TIMER:
-            self.timer.setInterval(self.config.get('timer_seconds') * 1000)
-            self.timer.start()
-
-        elif self.config.get('mode') == MODE_WATCH_FILES:
-            current_paths = self.watcher.files() + self.watcher.directories()
-            if current_paths:
-                self.watcher.removePaths(current_paths)
-            self.watch_window = {}
-            self.watcher.addPaths(self.config.get('watched_files'))
-
-        elif self.config.get('mode') == MODE_WATCH_FOLDER:
-            current_paths = self.watcher.files() + self.watcher.directories()
-            if current_paths:
-                self.watcher.removePaths(current_paths)
-            self.watcher.addPath(self.config.get('watched_folder'))
-
-    def shutdown(self):
-        if self.config.get('mode') == MODE_TIMER:
-            self.timer.stop()
-
-        elif self.config.get('mode') == MODE_WATCH_FILES or self.config.get('mode') == MODE_WATCH_FOLDER:
-            current_paths = self.watcher.files() + self.watcher.directories()
-            if current_paths:
-                self.watcher.removePaths(current_paths)
-            self.watch_window = {}
-        
-    def load_notebook(self, filename):
-        try:
-            with open(filename) as f:
-                nb = reads(f.read(), 'json')
-        except:
-            return None
-        else:
-            return nb
-
-    def file_trigger_accumulator(self, f):
-        # Accumulate triggers from changed files: if 3 files are specified to watch
-        # we only want to fire once _all_ files have changed (within the given watch window)
-        current_time = datetime.now()
-        self.watch_window[f] = current_time  # timestamp
-        self.watch_window = {k: v for k, v in self.watch_window.items() if current_time - timedelta(seconds=self.config.get('watch_window')) < v}
-
-        if set(self.watch_window.keys()) == set(self.watcher.files() + self.watcher.directories()):
-            self.trigger()
-
-    def trigger(self, e=None):
-        if self.config.get('is_active') == False:
-            return False
-        # Filesystemwatcher triggered
-        # Get the file and folder information; make available in vars object for run
-        if self.lock is None:
-            self.is_running = True
-            self.update()
-            self.lock = QTimer.singleShot(self.config.get('trigger_hold') * 1000, self.run)
-            # Shutdown so we don't get in infinite loops
-            self.shutdown()
-
-    def run(self, vars={}):
-
-        default_vars = {
-            'home': os.path.expanduser('~'),
-            'version': VERSION_STRING,
-        }
+        self.running_brush = QBrush(QColor(0, 255, 0, 50))
+        self.failed_brush = QBrush(QColor(255, 0, 0, 50))
+        self.active_pen = QPen(QColor('black'))
+        self.inactive_pen = QPen(QColor('#aaaaaa'))
+
+    def paint(self, painter, option, index):
+        display = index.data(DISPLAY_ROLE)
+        if display is None:
+            return
+
+        painter.setFont(self.font)
 
-        default_vars_and_config = dict(list(default_vars.items()) + list(self.config.config.items()))
+        selected = False
+        if display.is_running:
+            painter.fillRect(option.rect, self.running_brush)
+        elif display.success == False:
+            painter.fillRect(option.rect, self.failed_brush)
+        elif option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+            selected = True
 
-        if self.runner == None:
-            # Postpone init to trigger for responsiveness on add/remove
-            self.runner = NotebookRunner(None, pylab=True, mpl_inline=True)
+        x, y = option.rect.x(), option.rect.y()
+        width = option.rect.width() - 40
 
-        if self.config.get('mode') == MODE_WATCH_FOLDER and self.config.get('iterate_watched_folder'):
-            for (dirpath, dirnames, filenames) in os.walk(self.config.get('watched_folder')):
-                break
+        painter.drawPixmap(x + 5, y + 4, icon_pixmap('document-attribute-i-sm.png'))
+        painter.drawPixmap(x + 5, y + 20, icon_pixmap(display.mode_icon))
+        painter.drawPixmap(x + 5, y + 36, icon_pixmap('disk-sm.png'))
 
-            filenames = [f for f in filenames if self.config.get('iterate_wildcard') in f]
-            logging.info('Watched folder contains %d files; looping' % len(filenames))
-            # Filenames contains the list of files in the folder
+        if selected:
+            # Drawn on the highlight, so in the colour the style gives for that
+            painter.setPen(option.palette.highlightedText().color())
         else:
-            filenames = [None]
+            painter.setPen(self.active_pen if display.is_active else self.inactive_pen)
 
-        self.latest_run['timestamp'] = datetime.now()
+        # NOTEBOOK
+        painter.drawText(QRect(x + 20, y + 4, width, 20), Qt.AlignLeft, display.text('notebooks', self.metrics, width))
 
-        try:
-            for f in filenames:
-                now = datetime.now()
-                current_vars = {
-                    'datetime': now.strftime("%Y-%m-%d %H.%M.%S"),
-                    'date': now.date().strftime("%Y-%m-%d"),
-                    'time': now.time().strftime("%H.%M.%S"),
-                    'filename': f,
-                }
-                vars = dict(list(default_vars_and_config.items()) + list(current_vars.items()))
-
-                for nb_path in self.config.get('notebook_paths'):
-                    nb = self.load_notebook(nb_path)
-
-                    if nb:
-                        # Add currently running notebook path to vars
-                        vars['notebook_path'] = nb_path
-                        vars['notebook_filename'] = os.path.basename(nb_path)
-
-                        vars['output_path'] = self.config.get('output_path').format(**vars)
-                        parent_folder = os.path.dirname(vars['output_path'])
-                        if parent_folder:
-                            try:
-                                utils.mkdir_p(parent_folder)
-                            except:  # Can't create folder
-                                self.latest_run['success'] = False
-                                raise
-
-                        self.run_notebook(nb, vars)
-
-                    else:
-                        raise NotebookNotFound(nb_path)
-
-        except:
-            self.latest_run['success'] = False
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            logging.error("%s\n%s\n%s" % (exctype, value, traceback.format_exc()))
-
-        finally:
-            self.is_running = False
-            self.lock = None
-            self.update()
-            # Restart
-            self.startup()            
-
-    def run_notebook(self, nb, vars={}):
-        if len(nb['worksheets']) == 0:
-            nb['worksheets'] = [NotebookNode({'cells': [], 'metadata': {}})]
-
-        start = nb['worksheets'][0]['cells']
-        start.insert(0, Struct(**{
-            'cell_type': 'code',
-            'language': 'python',
-            'outputs': [],
-            'collapsed': False,
-            'prompt_number': -1,
-            'input': 'qtipy=%s' % vars,
-            'metadata': {},
-        }))
-        self.runner.nb = nb
+        # WATCH PATH
+        if display.watched:
+            painter.drawText(QRect(x + 20, y + 20, width, 20), Qt.AlignLeft, display.text('watched', self.metrics, width))
 
-        try:
-            self.runner.run_notebook()
-        except:
-            self.latest_run['success'] = False
-            raise
-        else:
-            self.latest_run['success'] = True
-        finally:
-            ext = dict(
-                html='html',
-                slides='slides',
-                latex='latex',
-                markdown='md',
-                python='py',
-                rst='rst',
-            )
-
-            output, resources = IPyexport(IPyexporter_map[self.config.get('output_format')], self.runner.nb)
-            output_path = vars['output_path'] + 'notebook.%s' % ext[self.config.get('output_format')]
-            logging.info("Exporting updated notebook to %s" % output_path)
-            with open(output_path, "w") as f:
-                f.write(output)
-
-    def update(self):
-        global _w
-        _w.viewer.update(self.index())
+        # OUTPUT
+        painter.drawText(QRect(x + 20, y + 36, width, 20), Qt.AlignLeft, display.text('output', self.metrics, width))
+
+        # LATEST RUN
+        if display.latest_run:
+            painter.drawText(QRect(x + 5, y + 52, option.rect.width() - 10, 20), Qt.AlignLeft, display.latest_run)
+
+    def sizeHint(self, option, index):
+        return QSize(200, 70)
 
 
 class MainWindow(QMainWindow):
@@ -623,6 +618,11 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
 
+        self.settings = get_settings()
+        apply_settings()
+        # Start kernels once the window is up; they are not needed to show it
+        QTimer.singleShot(0, get_kernel_pool().start)
+
         self.menuBars = {
             'file': self.menuBar().addMenu(tr('&File')),
             'edit': self.menuBar().addMenu(tr('&Edit')),
@@ -688,6 +688,12 @@ class MainWindow(QMainWindow):
         t.addAction(action)
         self.menuBars['control'].addAction(action)
 
+        action = QAction(tr('Preferences...'), self)
+        action.setMenuRole(QAction.PreferencesRole)
+        action.setStatusTip('Execution and kernel pool settings')
+        action.triggered.connect(self.edit_preferences)
+        self.menuBars['edit'].addAction(action)
+
         t = self.addToolBar('Manual')
         t.setIconSize(QSize(16, 16))
 
@@ -703,22 +709,26 @@ class MainWindow(QMainWindow):
         t.addWidget(btn)
         #self.menuBars['control'].addAction(action)
 
+        action = QAction(QIcon(os.path.join(utils.scriptdir, 'icons', 'arrow-circle-315.png')), tr('Reprocess all'), self)
+        action.setStatusTip('Run over all files in the watched folder, including those already processed')
+        action.triggered.connect(self.reprocess_automaton)
+        t.addAction(action)
+        self.menuBars['control'].addAction(action)
+
         self.tabs = QTabWidget(self)
         self.tabs.setTabPosition(QTabWidget.South)
 
         self.viewer = QListView()
         #self.viewer.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.viewer.setItemDelegate(AutomatonListDelegate(self.viewer))
-        self.automatons = QStandardItemModel(self.viewer)
+        self.automatons = AutomatonListModel(self.viewer)
         self.viewer.setModel(self.automatons)
 
         # Initiate logging
-        self.log = QTextEdit()
-        self.log._current_rows = []
-        self.log.setReadOnly(True)
-
-        logHandler = Logger(self, self.log)
-        logging.getLogger().addHandler(logHandler)
+        self.log_model = LogModel(self.settings.get('log_retention'), self)
+        self.log_handler = LogHandler(self.log_model)
+        logging.getLogger().addHandler(self.log_handler)
+        self.log = LogView(self.log_model)
         logging.info('Welcome to QtIPy')
 
         self.tabs.addTab(self.viewer, 'Automatons')
@@ -742,27 +752,39 @@ class MainWindow(QMainWindow):
         - define the output folder/file pattern
         - set config settings
         '''
-        automaton = Automaton()
-        self.automatons.appendRow(automaton)
-        lastitem = self.automatons.item(self.automatons.rowCount() - 1)
-        self.viewer.setCurrentIndex(lastitem.index())
+        index = self.add_automaton(Automaton())
+        self.viewer.setCurrentIndex(index)
         self.edit_automaton()
 
+    def add_automaton(self, automaton):
+        return self.automatons.add(automaton)
+
+    def current_automaton(self):
+        index = self.viewer.selectionModel().currentIndex()
+        if index.isValid():
+            return self.automatons.automaton(index.row())
+
+    def all_automatons(self):
+        return self.automatons.automatons()
+
     def edit_automaton(self):
         '''
         
         
         '''
-        try:
-            automaton = self.automatons.itemFromIndex(self.viewer.selectionModel().currentIndex())
-        except:
+        automaton = self.current_automaton()
+        if automaton is None:
             return
 
         automaton.shutdown()
         dlg = AutomatonDialog(self)
-        dlg.config.set_many(automaton.config.config)
+        # Include defaults so options not yet set on this automaton show their default values
+        dlg.config.set_many(dict(list(automaton.config.defaults.items()) + list(automaton.config.config.items())))
         if dlg.exec_():
-            automaton.config.set_many(dlg.config.config)
+            # Keep only what differs from the defaults, so defaults are not written to the automaton file
+            defaults = automaton.config.defaults
+            automaton.config.replace(dict(
+                (k, v) for k, v in dlg.config.config.items() if k not in defaults or v != defaults[k]))
             if automaton.config.get('is_active'):
                 automaton.startup()
             automaton.update()
@@ -772,17 +794,20 @@ class MainWindow(QMainWindow):
         '''
         _btn = QMessageBox.question(self, "Confirm delete", "Are you sure you want to delete this automaton?")
         if _btn == QMessageBox.Yes:
-            automaton = self.automatons.itemFromIndex(self.viewer.selectionModel().currentIndex())
+            index = self.viewer.selectionModel().currentIndex()
+            if not index.isValid():
+                return
+            automaton = self.automatons.remove(index.row())
+            # Deactivate so a run still executing does not restart the watchers
+            automaton.config.set('is_active', False)
+            automaton.cancel()
             automaton.shutdown()
-            automaton_idx = self.viewer.selectionModel().selectedIndexes()[0]
-            self.automatons.removeRows(automaton_idx.row(), 1, QModelIndex())
 
     def enable_automaton(self):
         '''
         '''
-        try:
-            automaton = self.automatons.itemFromIndex(self.viewer.selectionModel().currentIndex())
-        except:
+        automaton = self.current_automaton()
+        if automaton is None:
             return
         automaton.config.set('is_active', True)
         automaton.startup()
@@ -791,69 +816,76 @@ class MainWindow(QMainWindow):
     def pause_automaton(self):
         '''
         '''
-        try:
-            automaton = self.automatons.itemFromIndex(self.viewer.selectionModel().currentIndex())
-        except:
+        automaton = self.current_automaton()
+        if automaton is None:
             return
         automaton.config.set('is_active', False)
+        automaton.cancel()
         automaton.shutdown()
         automaton.update()
 
     def run_automaton(self):
         '''
         '''
-        try:
-            automaton = self.automatons.itemFromIndex(self.viewer.selectionModel().currentIndex())
-        except:
+        automaton = self.current_automaton()
+        if automaton is None:
             return
-        automaton.trigger(None)
+        automaton.trigger(None, immediate=True)
 
-    def load_automatons(self):
+    def reprocess_automaton(self):
         '''
         '''
-        global _w
-        filename, _ = QFileDialog.getOpenFileName(_w, "Load QtIPy Automatons", '', "QtIPy Automaton File (*.qifx);;All files (*.*)")
-        if filename:
+        automaton = self.current_automaton()
+        if automaton is None:
+            return
+        automaton.reprocess_all()
 
-            self.automatons.clear()
+    def edit_preferences(self):
+        '''
+        '''
+        dlg = PreferencesDialog(self)
+        dlg.config.set_many({k: self.settings.get(k) for k in self.settings.defaults})
+        if dlg.exec_():
+            self.settings.set_many(dlg.config.config)
+            apply_settings()
+            self.log_model.set_retention(self.settings.get('log_retention'))
+            get_kernel_pool().start()
+
+    def clear_automatons(self):
+        for automaton in self.all_automatons():
+            automaton.config.set('is_active', False)
+            automaton.cancel()
+            automaton.shutdown()
+        self.automatons.clear()
 
-            tree = et.parse(filename)
-            automatons = tree.getroot()
+    def load_automatons(self):
+        '''
+        '''
+        filename, _ = QFileDialog.getOpenFileName(self, "Load QtIPy Automatons", '', "QtIPy Automaton File (*.qifx);;All files (*.*)")
+        if filename:
 
-            for automatonx in automatons.findall('Automaton'):
-                automaton = Automaton()
-                automaton.config.setXMLConfig(automatonx)
+            self.clear_automatons()
 
-                self.automatons.appendRow(automaton)
+            for automaton in load_automatons(filename):
+                self.add_automaton(automaton)
                 automaton.startup()
-            
+
     def save_automatons(self):
         '''
         '''
-        global _w
-        filename, _ = QFileDialog.getSaveFileName(_w, "Save QtIPy Automatons", '', "QtIPy Automaton File (*.qifx);;All files (*.*)")
+        filename, _ = QFileDialog.getSaveFileName(self, "Save QtIPy Automatons", '', "QtIPy Automaton File (*.qifx);;All files (*.*)")
         if filename:
-
-            root = et.Element("QtIPy")
-            root.set('xmlns:mpwfml', "http://martinfitzpatrick.name/schema/QtIPy/2013a")
-
-            # Build a JSONable object representing the entire current workspace and write it to file
-            for i in range(0, self.automatons.rowCount()):
-                a = self.automatons.item(i)
-
-                automaton = et.SubElement(root, "Automaton")
-                automaton = a.config.getXMLConfig(automaton)
-
-            tree = et.ElementTree(root)
-            tree.write(filename)  # , pretty_print=True)
+            save_automatons(filename, self.all_automatons())
 
     def sizeHint(self):
         return QSize(400, 500)
 
 
-def main():
+def main(argv=None):
+    startup.mark('imports')
+
     # Create a Qt application
-    app = QApplication(sys.argv)
+    app = QApplication(argv or sys.argv)
     app.setStyle('fusion')
 
     app.setOrganizationName("QtIPy")
@@ -862,11 +894,21 @@ def main():
 
     locale = QLocale.system().name()
 
-    global _w
-    _w = MainWindow()
+    install_run_log()
+
+    window = MainWindow()
+    startup.mark('main window')
+    # Runs on the first pass of the event loop, after the window has been shown
+    QTimer.singleShot(0, startup.report)
     logging.info('Ready.')
     app.exec_()  # Enter Qt application main loop
+    logging.getLogger().removeHandler(window.log_handler)
     logging.info('Exiting.')
+    get_engine().shutdown()
+    get_kernel_pool().shutdown()
+    get_export_pipeline().shutdown()
+    get_settings().flush()
+    shutdown_run_log()
 
     sys.exit()
 
@@ -0,0 +1,868 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+try:
+    import xml.etree.cElementTree as et
+except ImportError:
+    import xml.etree.ElementTree as et
+
+import os
+import re
+import sys
+import time
+import uuid
+import threading
+import traceback
+
+from collections import deque
+from datetime import datetime
+
+from .qtcore import *
+from . import utils
+from .engine import Job, get_engine
+from .kernels import get_kernel_pool, inject_vars, run_batch
+from .manifest import Manifest, manifest_path
+from .notebooks import get_notebook_cache
+from .cellcache import get_cell_cache
+from .export import get_export_pipeline, EXPORT_EXTENSIONS
+from .runlog import run_context, current_run
+from .statusbus import get_status_bus
+from .configstore import SnapshotConfigManager
+from .watchers import create_folder_watcher, BACKEND_AUTO, EVENT_DELETED, EVENT_OVERFLOW, EVENT_CLOSED, EVENT_MOVED
+from .stability import StabilityGate
+from .fingerprints import ContentChangeFilter
+from .watchwindow import WatchWindow
+from .selection import FileSelector, SORT_NAME, entry_stat
+
+
+VERSION_STRING = '0.0.1'
+
+MODE_MANUAL = 0
+MODE_WATCH_FILES = 1
+MODE_WATCH_FOLDER = 2
+MODE_TIMER = 3
+MODE_WATCH_FILE_EVENTS = 4  # Each new or changed file in the watched folder is a run of its own
+
+# Secs a file must be left alone before a per-file run uses it, where no wait is set and closes are not reported
+EVENT_STABLE_QUIET = 2
+
+# Output prefixes remembered before older ones are forgotten, for per-file runs (which never end together)
+OUTPUT_PATHS_LIMIT = 1000
+
+# Trigger states: waiting for events; events seen, waiting for trigger_hold to pass
+# without more; run queued or executing (events now collect for one follow-up run)
+STATE_IDLE = 0
+STATE_HOLDING = 1
+STATE_RUNNING = 2
+
+
+class NotebookNotFound(Exception):
+    pass
+
+
+class Automaton(QObject):
+    '''
+    A notebook automaton: its config, triggers (watcher/timer) and runs.
+
+    Watchers stay attached while the automaton is active. Changed files are
+    held by the stability gate until they have finished being written, then
+    added to pending_paths, restarting the trigger_hold debounce; once it
+    expires, or trigger_max_hold after the first of them, the run is queued with
+    those paths. Timer and manual triggers skip the debounce. Events during a run are kept
+    for exactly one follow-up run once it finishes.
+
+    In MODE_WATCH_FILE_EVENTS released files skip the debounce: each becomes a
+    job of its own, with up to event_concurrency of them executing at a time.
+    Files are always held until complete, and a change to a file drops its run
+    if that has not started yet; it is queued again once the file is released.
+
+    Has no dependency on the GUI; state changes are published to the status bus,
+    which views listen to. update() may be called from any thread.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(Automaton, self).__init__(*args, **kwargs)
+
+        self.watcher = QFileSystemWatcher()
+        self.folder_watcher = None
+        self.timer = QTimer()
+
+        self.hold_timer = QTimer()
+        self.hold_timer.setSingleShot(True)
+        self.hold_timer.timeout.connect(self.submit)
+
+        self.gate = StabilityGate(parent=self)
+        self.gate.released.connect(self.on_files_released)
+
+        self.contents = ContentChangeFilter(parent=self)
+        self.contents.changed.connect(self.on_contents_changed)
+
+        self.state = STATE_IDLE
+        self.hold_started = None  # When the first event of the current hold arrived
+        self.pending_paths = set()
+        self.rerun = False
+        self.outputs_mutex = QMutex()
+        self.output_prefixes = set()  # Our own runs write under these; changes there are ignored
+        self.previous_output_prefixes = set()
+
+        self.watch_window = None  # WatchWindow over watched_files, while watching
+        self.selector = None  # (config values, FileSelector) of the last selection
+
+        self.latest_run = {}
+        self.is_running = False
+
+        # Progress of the current run, in files
+        self.progress_mutex = QMutex()
+        self.files_done = 0
+        self.files_total = 0
+
+        # Progress of per-file runs since they were last all done; kept on the GUI thread
+        self.events_done = 0
+        self.events_total = 0
+
+        self.config = SnapshotConfigManager()
+        self.config.set_defaults({
+            'mode': MODE_WATCH_FOLDER,
+            'is_active': True,
+            'trigger_hold': 1,
+            'trigger_max_hold': 10,  # secs a steady stream of events can hold a run back; 0 for no limit
+            'stable_quiet': 0,  # secs a changed file must be left alone before it is used; 0 to use it at once
+            'stable_on_close': True,  # or once closed after writing, where the watcher can tell
+            'notebook_paths': '',
+            'output_path': '{home}/{notebook_filename}_{datetime}_',
+            'output_format': 'html',
+            'strip_outputs': True,
+
+            'watched_files': [],
+            'watched_folder': '',
+            'watch_window': 15,
+            'watch_require': 0,  # Changed files needed to trigger; 0 for all
+            'watch_compare_contents': True,  # Watched files only count as changed if their content has
+            'watch_depth': 0,  # Levels of subfolders; -1 for all
+            'watch_backend': BACKEND_AUTO,
+            'watch_poll_interval': 2,
+
+            'iterate_watched_folder': True,
+            'iterate_wildcard': '*.csv',  # Globs, separated by ';'
+            'iterate_regex': '',
+            'iterate_exclude': '',
+            'iterate_min_size': 0,  # KB
+            'iterate_max_size': 0,  # KB; 0 for no limit
+            'iterate_max_age': 0,  # hours; 0 for no limit
+            'iterate_sort': SORT_NAME,
+            'iterate_sort_reverse': False,
+            'iterate_limit': 0,
+            'iterate_parallel': False,
+            'iterate_parallel_limit': 4,
+            'iterate_incremental': False,
+            'incremental_hash': False,
+            'batch_setup': False,
+
+            'cache_cells': False,
+            'cache_inputs': [],
+
+            'timer_seconds': 60,
+
+            'event_concurrency': 2,
+        })
+        # Identifies the automaton's on-disk state (e.g. manifest); replaced when loaded from file
+        self.config.set('automaton_id', uuid.uuid4().hex)
+        self.manifest = None
+
+        self.job = None
+
+        # Per-file runs: paths waiting for a slot, paths not yet started, and submitted jobs
+        self.event_queue = deque()
+        self.event_queued = set()
+        self.event_jobs = {}  # job -> path
+
+        self.latest_run = {
+            'timestamp': None,
+            'success': None,
+            'run_id': None,
+        }
+
+        # Views only hear of changes through the status bus, so publish config changes too
+        self.config.updated.connect(self.update)
+
+        # Set up all the triggers
+        self.watcher.fileChanged.connect(self.on_file_changed)
+        self.timer.timeout.connect(self.on_timer)
+
+    def startup(self):
+        if self.config.get('is_active') == False:
+            return False
+
+        if self.config.get('mode') == MODE_TIMER:
+            self.timer.setInterval(self.config.get('timer_seconds') * 1000)
+            self.timer.start()
+
+        elif self.config.get('mode') == MODE_WATCH_FILES:
+            current_paths = self.watcher.files() + self.watcher.directories()
+            if current_paths:
+                self.watcher.removePaths(current_paths)
+            self.watch_window = WatchWindow(
+                self.config.get('watched_files'), self.config.get('watch_window'), self.config.get('watch_require'))
+            self.watcher.addPaths(self.config.get('watched_files'))
+            if self.config.get('watch_compare_contents'):
+                self.contents.reset(self.config.get('watched_files'))
+
+        elif self.config.get('mode') in (MODE_WATCH_FOLDER, MODE_WATCH_FILE_EVENTS):
+            self.stop_folder_watcher()
+            if not self.watched_folder(self.config):
+                # An empty path would otherwise mean the current folder
+                logging.warning('No folder to watch is set')
+                return
+            self.folder_watcher = create_folder_watcher(
+                self.config.get('watched_folder'),
+                self.config.get('watch_backend'),
+                self.watch_depth(self.config),
+                self.config.get('watch_poll_interval'),
+                parent=self,
+            )
+            self.folder_watcher.events.connect(self.on_folder_events)
+
+        # Waiting for a file to be closed only works where the watcher says so; otherwise it would be held forever
+        on_close = self.config.get('stable_on_close') and \
+            self.folder_watcher is not None and self.folder_watcher.reports_close
+        quiet = self.config.get('stable_quiet')
+        if self.config.get('mode') == MODE_WATCH_FILE_EVENTS and not quiet and not on_close:
+            # A per-file run must never see a file half-written
+            quiet = EVENT_STABLE_QUIET
+        self.gate.configure(quiet, on_close)
+
+    def shutdown(self):
+        self.gate.clear()
+
+        if self.config.get('mode') == MODE_TIMER:
+            self.timer.stop()
+
+        elif self.config.get('mode') == MODE_WATCH_FILES:
+            current_paths = self.watcher.files() + self.watcher.directories()
+            if current_paths:
+                self.watcher.removePaths(current_paths)
+            self.watch_window = None
+
+        elif self.config.get('mode') in (MODE_WATCH_FOLDER, MODE_WATCH_FILE_EVENTS):
+            self.stop_folder_watcher()
+
+    def stop_folder_watcher(self):
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher.events.disconnect(self.on_folder_events)
+            self.folder_watcher.deleteLater()
+            self.folder_watcher = None
+
+    def watched_folder(self, config):
+        # '' (or 'None', as pyqtconfig loads an empty string) if none is set
+        folder = config.get('watched_folder')
+        return folder if folder not in (None, 'None') else ''
+
+    def watch_depth(self, config):
+        depth = config.get('watch_depth')
+        return None if depth is None or depth < 0 else depth
+
+    def load_notebook(self, filename, strip=True):
+        # Parsed once and shared between runs; we get a copy that is safe to modify
+        try:
+            nb = get_notebook_cache().get(filename, strip=strip)
+        except:
+            return None
+        else:
+            return nb
+
+    def get_manifest(self, spec=None):
+        spec = spec or self.config.freeze()
+        path = manifest_path(spec.get('automaton_id'))
+        if self.manifest is None or self.manifest.path != path:
+            self.manifest = Manifest(path)
+        self.manifest.use_hash = spec.get('incremental_hash')
+        return self.manifest
+
+    def reprocess_all(self):
+        # Forget which files have been processed, then run over the whole folder
+        manifest = self.get_manifest()
+        manifest.clear()
+        manifest.save()
+        self.trigger(immediate=True)
+
+    def file_selector(self, config):
+        # Patterns are compiled once, and again only when they change. Returns None if they are invalid,
+        # in which case nothing is selected (rather than everything)
+        values = tuple(config.get(k) for k in (
+            'iterate_wildcard', 'iterate_regex', 'iterate_exclude', 'iterate_min_size', 'iterate_max_size',
+            'iterate_max_age', 'iterate_sort', 'iterate_sort_reverse', 'iterate_limit',
+        ))
+        selector = self.selector
+        if selector is None or selector[0] != values:
+            wildcard, regex, exclude, min_size, max_size, max_age, sort, reverse, limit = values
+            # An empty pattern may have been saved, and loaded back, as 'None'
+            wildcard, regex, exclude = [p if p not in (None, 'None') else '' for p in (wildcard, regex, exclude)]
+            try:
+                selector = (values, FileSelector(
+                    wildcard, regex, exclude,
+                    min_size=min_size * 1024, max_size=max_size * 1024, max_age=max_age * 60 * 60,
+                    sort=sort, reverse=reverse, limit=limit,
+                ))
+            except re.error as e:
+                logging.error('Invalid file selection pattern (%s); no files will be selected' % e)
+                selector = (values, None)
+            self.selector = selector
+        return selector[1]
+
+    def on_folder_events(self, events):
+        # Any change but our own outputs counts. When runs iterate over the folder (or each file is a
+        # run) only new, modified or moved-in files that would be selected do; a removal is nothing to run
+        iterating = self.config.get('mode') == MODE_WATCH_FILE_EVENTS or self.config.get('iterate_watched_folder')
+        selector = self.file_selector(self.config)
+        folder = os.path.abspath(self.config.get('watched_folder'))
+        outputs = self.own_outputs()
+        changed = []
+        dropped = []
+        for kind, path in events:
+            if kind == EVENT_OVERFLOW:
+                # Changes were missed; run over everything
+                self.trigger()
+            elif path.startswith(outputs):
+                continue
+            elif kind == EVENT_DELETED:
+                self.gate.discard(path)
+                if not iterating:
+                    self.trigger([path])
+                else:
+                    dropped.append(path)
+            elif not iterating or (selector is not None and selector.match_name(folder, path)):
+                # Files moved into place were written elsewhere, so are already complete
+                changed.append((path, kind in (EVENT_CLOSED, EVENT_MOVED)))
+
+        if self.config.get('mode') == MODE_WATCH_FILE_EVENTS:
+            # A run not yet started would see the file as it was, or half-written; the newer event replaces it
+            self.dequeue_files(dropped + [path for path, closed in changed])
+
+        if changed:
+            self.gate.add(changed)
+
+    def on_file_changed(self, f):
+        if os.path.exists(f):
+            # If replaced rather than modified (e.g. by an editor) the watcher has dropped it.
+            # Adding a path already watched does nothing, and avoids listing all watched files
+            self.watcher.addPath(f)
+
+        self.gate.add([(f, False)])
+
+    def on_files_released(self, paths):
+        # Files that have finished being written
+        if self.config.get('mode') == MODE_WATCH_FILE_EVENTS:
+            self.enqueue_files(paths)
+        elif self.config.get('mode') != MODE_WATCH_FILES:
+            self.trigger(paths)
+        elif self.config.get('watch_compare_contents'):
+            self.contents.add(paths)
+        else:
+            self.on_contents_changed(paths)
+
+    def on_contents_changed(self, paths):
+        for f in paths:
+            self.file_trigger_accumulator(f)
+
+    def file_trigger_accumulator(self, f):
+        # Accumulate triggers from changed files: if 3 files are specified to watch
+        # we only want to fire once _all_ (or watch_require) have changed within the watch window
+        if self.watch_window is None:
+            return
+
+        paths = self.watch_window.add(f)
+        if paths:
+            self.trigger(paths)
+
+    def on_timer(self):
+        self.trigger(immediate=True)
+
+    def trigger(self, paths=None, immediate=False):
+        '''
+        Request a run with paths (if any) among the changed files. Requests from
+        events are debounced; immediate ones (timer, manual) are queued at once.
+        '''
+        if self.config.get('is_active') == False:
+            return False
+
+        if paths:
+            self.pending_paths.update(paths)
+
+        if self.state == STATE_RUNNING:
+            # Run once more when this one is done, with everything that changed meanwhile
+            self.rerun = True
+            return
+
+        if immediate:
+            self.hold_timer.stop()
+            self.submit()
+            return
+
+        # Debounce: each new event restarts the hold, but never beyond max hold from the first
+        now = time.time()
+        if self.state != STATE_HOLDING:
+            self.hold_started = now
+        hold = self.config.get('trigger_hold')
+        max_hold = self.config.get('trigger_max_hold')
+        if max_hold:
+            hold = min(hold, max(0, self.hold_started + max_hold - now))
+
+        self.state = STATE_HOLDING
+        self.hold_timer.start(int(hold * 1000))
+
+    def submit(self):
+        # Queue the run on the execution engine; run() executes on a pool thread
+        paths = sorted(self.pending_paths)
+        self.pending_paths = set()
+
+        self.state = STATE_RUNNING
+        self.hold_started = None
+        with QMutexLocker(self.progress_mutex):
+            self.files_done = self.files_total = 0  # Until the run has selected its files
+        self.update_running()
+
+        # Outputs of earlier runs can no longer be mid-write; keep the last run's only. Per-file
+        # runs may still be writing theirs, so while any are under way outputs are only bounded by count
+        if not self.event_jobs:
+            with QMutexLocker(self.outputs_mutex):
+                self.previous_output_prefixes, self.output_prefixes = self.output_prefixes, set()
+
+        # Files still being written are left for the run that follows once they are complete
+        self.job = Job(self.run, paths, self.gate.holding())
+        self.job.owner = self
+        self.job.signals.finished.connect(self.on_run_finished)
+        get_engine().submit(self.job)
+
+    def enqueue_files(self, paths):
+        if self.config.get('is_active') == False:
+            return
+
+        for path in paths:
+            # A file released again before its run started is already covered by it
+            if path not in self.event_queued:
+                self.event_queued.add(path)
+                self.event_queue.append(path)
+                self.events_total += 1
+
+        self.dispatch_files()
+
+    def dequeue_files(self, paths):
+        # Drop the runs for paths that have not started
+        paths = set(paths) & self.event_queued
+        if not paths:
+            return
+
+        self.event_queue = deque(p for p in self.event_queue if p not in paths)
+        submitted = [job for job, p in self.event_jobs.items() if p in paths]
+        if submitted:
+            # Those the engine has started already are left to complete
+            get_engine().cancel(self, submitted)
+            active = get_engine().active
+            for job in submitted:
+                if job not in active:
+                    del self.event_jobs[job]
+                else:
+                    paths.discard(self.event_jobs[job])
+
+        self.event_queued -= paths
+        self.events_total -= len(paths)
+        self.dispatch_files()
+
+    def dispatch_files(self):
+        limit = max(1, self.config.get('event_concurrency'))
+        while self.event_queue and len(self.event_jobs) < limit:
+            path = self.event_queue.popleft()
+            job = Job(self.run_file_event, path)
+            job.owner = self
+            job.signals.started.connect(self.on_file_event_started)
+            job.signals.finished.connect(self.on_file_event_finished)
+            self.event_jobs[job] = path
+            get_engine().submit(job)
+
+        if not self.event_jobs:
+            self.events_done = self.events_total = 0
+        self.update_running()
+
+    def on_file_event_started(self, job):
+        # From now on a change to the file needs a run of its own
+        self.event_queued.discard(self.event_jobs.get(job))
+
+    def on_file_event_finished(self, job):
+        if self.event_jobs.pop(job, None) is not None:
+            self.events_done += 1
+        self.dispatch_files()
+
+    def cancel_file_events(self):
+        # Per-file jobs the engine has not started are dropped; those executing are left to complete
+        self.event_queue.clear()
+        self.event_queued = set()
+        get_engine().cancel(self, self.event_jobs)
+        active = get_engine().active
+        self.event_jobs = dict((job, path) for job, path in self.event_jobs.items() if job in active)
+        self.events_total = self.events_done + len(self.event_jobs)
+        self.dispatch_files()
+
+    def cancel(self):
+        # Drop a held or queued run, and any follow-up; a run already executing is left to complete
+        self.hold_timer.stop()
+        self.hold_started = None
+        self.pending_paths = set()
+        self.rerun = False
+        if self.event_jobs or self.event_queue:
+            self.cancel_file_events()
+
+        if self.job is not None:
+            get_engine().cancel(self, [self.job])
+            if self.job not in get_engine().active:
+                # Dropped, or already done (its finished signal may still be on its way)
+                self.job = None
+        if self.job is None:
+            self.state = STATE_IDLE
+            self.update_running()
+
+    def on_run_finished(self, job):
+        # Back on the GUI thread
+        if job is not self.job:
+            return  # Cancelled, and forgotten, before it finished
+
+        self.job = None
+        self.state = STATE_IDLE
+        self.update_running()
+
+        if self.rerun:
+            self.rerun = False
+            self.trigger()
+
+    def default_vars(self, spec, changed_paths=None):
+        default_vars = {
+            'home': os.path.expanduser('~'),
+            'version': VERSION_STRING,
+            'changed_paths': changed_paths or [],
+        }
+        return dict(list(default_vars.items()) + list(spec.items()))
+
+    def run(self, changed_paths=None, skip_paths=None):
+        # Read the config once; the run then sees the same values throughout
+        spec = self.config.freeze()
+
+        # Records logged during the run, from any of its threads, go to the run's log file
+        with run_context(spec['automaton_id']) as run_id:
+            self.latest_run['run_id'] = run_id
+            logging.info('Starting run %s' % run_id)
+
+            default_vars_and_config = self.default_vars(spec, changed_paths)
+
+            # A manual run of a per-file automaton goes over the whole folder
+            if spec.get('mode') in (MODE_WATCH_FOLDER, MODE_WATCH_FILE_EVENTS) and spec.get('iterate_watched_folder') \
+                    and not self.watched_folder(spec):
+                logging.warning('No folder to watch is set; no files to run over')
+                filenames = []
+                manifest = None
+
+            elif spec.get('mode') in (MODE_WATCH_FOLDER, MODE_WATCH_FILE_EVENTS) and spec.get('iterate_watched_folder'):
+                # Filenames are relative to the watched folder, including any subfolders
+                dirpath = spec.get('watched_folder')
+                root = os.path.abspath(dirpath)
+                skip_paths = skip_paths or set()
+                selector = self.file_selector(spec)
+                selected = (
+                    (os.path.relpath(e.path, root), e)
+                    for e in (selector.select(root, self.watch_depth(spec)) if selector is not None else [])
+                    if e.path not in skip_paths
+                )
+
+                if spec.get('iterate_incremental'):
+                    # Listing, selection and the manifest check are one pass; the stat is reused
+                    manifest = self.get_manifest(spec)
+                    filenames = [f for f, e in selected if manifest.is_changed(os.path.join(dirpath, f), entry_stat(e))]
+                    logging.info('%d selected files in the watched folder are new or changed' % len(filenames))
+                else:
+                    manifest = None
+                    filenames = [f for f, e in selected]
+                    logging.info('Selected %d files in the watched folder; looping' % len(filenames))
+
+            else:
+                filenames = [None]
+                manifest = None
+
+            self.latest_run['timestamp'] = datetime.now()
+            exports = []
+            with QMutexLocker(self.progress_mutex):
+                self.files_done = 0
+                self.files_total = len(filenames)
+            self.update()
+
+            if not filenames:
+                self.latest_run['success'] = True
+                return
+
+            if spec.get('iterate_parallel') and len(filenames) > 1:
+                success = self.run_parallel(filenames, spec, default_vars_and_config, exports, manifest)
+            else:
+                success = self.run_files(deque(filenames), spec, default_vars_and_config, exports, manifest, stop_on_error=True)
+
+            # Notebooks are exported in the background; the run is complete once all are written
+            exported = all([t.wait() for t in exports])
+
+            self.latest_run['success'] = success and exported
+
+            if manifest is not None:
+                manifest.save()
+
+    def run_file_event(self, path):
+        # One file as a run of its own; several may be executing at once
+        spec = self.config.freeze()
+
+        with run_context(spec['automaton_id']) as run_id:
+            self.latest_run['run_id'] = run_id
+            logging.info('Starting run %s for %s' % (run_id, path))
+
+            f = os.path.relpath(path, os.path.abspath(spec.get('watched_folder')))
+            exports = []
+            success = self.run_files(
+                deque([f]), spec, self.default_vars(spec, [path]), exports, stop_on_error=True, progress=False)
+            exported = all([t.wait() for t in exports])
+
+            self.latest_run['timestamp'] = datetime.now()
+            self.latest_run['success'] = success and exported
+
+    def run_parallel(self, filenames, spec, default_vars_and_config, exports, manifest=None):
+        # Fan the files out over up to iterate_parallel_limit workers, each on its own kernel.
+        # All notebooks for a given file still run in order on one kernel. This job is the
+        # first worker; the others take engine slots that are free, so max_concurrent_runs holds.
+        queue = deque(filenames)
+        n = min(spec.get('iterate_parallel_limit') or QThread.idealThreadCount(), len(filenames))
+        helpers = get_engine().reserve(n - 1)
+        logging.info('Running %d files on %d parallel workers' % (len(filenames), helpers + 1))
+
+        results = []
+        automaton_id, run_id = current_run()
+
+        def work():
+            with run_context(automaton_id, run_id):
+                try:
+                    results.append(self.run_files(queue, spec, default_vars_and_config, exports, manifest))
+                except:
+                    logging.error("Worker failed:\n%s" % traceback.format_exc())
+
+        threads = [threading.Thread(target=work) for _ in range(helpers)]
+        try:
+            for t in threads:
+                t.daemon = True
+                t.start()
+            work()
+            for t in threads:
+                t.join()
+        finally:
+            get_engine().unreserve(helpers)
+
+        # Only successful once every worker has finished and all files ran cleanly
+        return len(results) == helpers + 1 and all(results)
+
+    def run_files(self, queue, spec, default_vars_and_config, exports, manifest=None, stop_on_error=False,
+                  progress=True):
+        # Take filenames from the (shared) queue and run them on a single leased kernel
+        # Kernels are shared between automatons; leasing blocks if the pool is exhausted
+        try:
+            runner = get_kernel_pool().lease()
+        except:
+            logging.error("Could not lease a kernel:\n%s" % traceback.format_exc())
+            return False
+
+        success = True
+        dirty = False
+
+        try:
+            while queue:
+                try:
+                    f = queue.popleft()
+                except IndexError:  # Emptied by another worker
+                    break
+
+                try:
+                    self.run_file(runner, f, spec, default_vars_and_config, exports)
+
+                except:
+                    from runipy.notebook_runner import NotebookError
+
+                    success = False
+                    if manifest is not None:
+                        manifest.record(os.path.join(spec.get('watched_folder'), f), False)
+                    traceback.print_exc()
+                    exctype, value = sys.exc_info()[:2]
+                    logging.error("%s\n%s\n%s" % (exctype, value, traceback.format_exc()))
+                    # Errors raised in cells leave the kernel usable; anything else may not have
+                    dirty = not isinstance(value, (NotebookError, NotebookNotFound))
+                    if dirty or stop_on_error:
+                        break
+
+                else:
+                    if manifest is not None:
+                        manifest.record(os.path.join(spec.get('watched_folder'), f), True)
+
+                finally:
+                    if progress:
+                        with QMutexLocker(self.progress_mutex):
+                            self.files_done += 1
+                        self.update()
+
+        finally:
+            get_kernel_pool().release(runner, dirty)
+
+        return success
+
+    def run_file(self, runner, f, spec, default_vars_and_config, exports):
+        now = datetime.now()
+        current_vars = {
+            'datetime': now.strftime("%Y-%m-%d %H.%M.%S"),
+            'date': now.date().strftime("%Y-%m-%d"),
+            'time': now.time().strftime("%H.%M.%S"),
+            'filename': f,
+        }
+        vars = dict(list(default_vars_and_config.items()) + list(current_vars.items()))
+
+        for nb_path in spec.get('notebook_paths'):
+            nb = self.load_notebook(nb_path, spec.get('strip_outputs'))
+
+            if nb:
+                # Add currently running notebook path to vars
+                vars['notebook_path'] = nb_path
+                vars['notebook_filename'] = os.path.basename(nb_path)
+
+                vars['output_path'] = spec.get('output_path').format(**vars)
+                parent_folder = os.path.dirname(vars['output_path'])
+                if parent_folder:
+                    utils.mkdir_p(parent_folder)
+                self.record_output(vars['output_path'], spec)
+
+                self.run_notebook(runner, nb, spec, vars, exports)
+
+            else:
+                raise NotebookNotFound(nb_path)
+
+    def run_notebook(self, runner, nb, spec, vars, exports):
+        if len(nb['worksheets']) == 0:
+            from IPython.nbformat.current import NotebookNode
+            nb['worksheets'] = [NotebookNode({'cells': [], 'metadata': {}})]
+
+        runner.nb = nb
+
+        try:
+            if spec.get('cache_cells'):
+                cache = get_cell_cache()
+                context = cache.context_key(vars, self.cache_inputs(spec, vars))
+                cache.run(runner, context, lambda: self.execute_notebook(runner, spec, vars))
+            else:
+                self.execute_notebook(runner, spec, vars)
+        finally:
+            # Export happens on the pipeline so the kernel can move on to the next file
+            output_format = spec.get('output_format')
+            output_path = vars['output_path'] + 'notebook.%s' % EXPORT_EXTENSIONS.get(output_format, output_format)
+            exports.append(get_export_pipeline().submit(nb, output_format, output_path))
+
+    def execute_notebook(self, runner, spec, vars):
+        # Set qtipy in the kernel namespace directly; on a kernel that already has it
+        # (e.g. the previous file in a folder loop) only the changed values are sent
+        inject_vars(runner, vars)
+
+        if spec.get('batch_setup'):
+            run_batch(runner, vars['notebook_path'])
+        else:
+            runner.run_notebook()
+
+    def cache_inputs(self, spec, vars):
+        # Files whose contents a run depends on, for the cell cache key
+        inputs = [f for f in spec.get('cache_inputs') if f]
+        if vars.get('filename'):
+            inputs.append(os.path.join(spec.get('watched_folder'), vars['filename']))
+        if spec.get('mode') == MODE_WATCH_FILES:
+            inputs.extend(spec.get('watched_files'))
+        return inputs
+
+    def record_output(self, output_path, spec):
+        # Called from run threads. Anything a notebook writes under its output path is ours, not just the
+        # exported notebook; so is the whole output folder, unless the watched folder is within it
+        prefix = os.path.abspath(output_path)
+        if output_path.endswith(('/', os.sep)):
+            prefix = os.path.join(prefix, '')
+
+        folder = os.path.join(os.path.dirname(prefix), '')
+        watched = spec.get('watched_folder')
+        if watched and not os.path.join(os.path.abspath(watched), '').startswith(folder):
+            prefix = folder
+
+        # Per-file runs never end together, so prefixes are also bounded by count
+        with QMutexLocker(self.outputs_mutex):
+            self.output_prefixes.add(prefix)
+            if len(self.output_prefixes) > OUTPUT_PATHS_LIMIT:
+                self.previous_output_prefixes, self.output_prefixes = self.output_prefixes, set()
+
+    def own_outputs(self):
+        # As a tuple, for str.startswith
+        with QMutexLocker(self.outputs_mutex):
+            return tuple(self.output_prefixes | self.previous_output_prefixes)
+
+    def update_running(self):
+        # Full runs and per-file runs are tracked apart; the automaton is running while either is
+        self.is_running = self.state == STATE_RUNNING or bool(self.event_jobs)
+        self.update()
+
+    def progress(self):
+        '''
+        Return (done, total) files of the run under way once it has selected them
+        or, failing that, of the per-file runs under way; None if there are none.
+        '''
+        if self.state == STATE_RUNNING:
+            with QMutexLocker(self.progress_mutex):
+                if self.files_total or not self.event_jobs:
+                    return self.files_done, self.files_total
+        if self.event_jobs:
+            return self.events_done, self.events_total
+        return None
+
+    def update(self):
+        get_status_bus().publish(self)
+
+    def status(self):
+        return {
+            'id': self.config.get('automaton_id'),
+            'notebook_paths': self.config.get('notebook_paths'),
+            'mode': self.config.get('mode'),
+            'is_active': self.config.get('is_active'),
+            'is_running': self.is_running,
+            'latest_run': {
+                'timestamp': self.latest_run['timestamp'].isoformat() if self.latest_run['timestamp'] else None,
+                'success': self.latest_run['success'],
+                'run_id': self.latest_run.get('run_id'),
+            },
+        }
+
+
+def load_automatons(filename):
+    '''
+    Read automatons from a .qifx file, as written by save_automatons.
+    '''
+    tree = et.parse(filename)
+    automatons = []
+    for automatonx in tree.getroot().findall('Automaton'):
+        automaton = Automaton()
+        automaton.config.setXMLConfig(automatonx)
+        automatons.append(automaton)
+    return automatons
+
+
+def save_automatons(filename, automatons):
+    root = et.Element("QtIPy")
+    root.set('xmlns:mpwfml', "http://martinfitzpatrick.name/schema/QtIPy/2013a")
+
+    # Build a JSONable object representing the entire current workspace and write it to file
+    for a in automatons:
+        automaton = et.SubElement(root, "Automaton")
+        automaton = a.config.getXMLConfig(automaton)
+
+    tree = et.ElementTree(root)
+    tree.write(filename)  # , pretty_print=True)
+
+
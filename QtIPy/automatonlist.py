@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .qt import *
+from .automaton import MODE_MANUAL, MODE_WATCH_FILES, MODE_WATCH_FOLDER, MODE_TIMER, MODE_WATCH_FILE_EVENTS
+from .registry import AutomatonRegistry
+from .statusbus import get_status_bus
+
+# Item data role holding an AutomatonDisplay
+DISPLAY_ROLE = Qt.UserRole + 1
+
+MODE_ICONS = {
+    MODE_MANUAL: 'hand-finger-sm.png',
+    MODE_WATCH_FILES: 'document-copy-sm.png',
+    MODE_WATCH_FOLDER: 'folder-horizontal-open-sm.png',
+    MODE_WATCH_FILE_EVENTS: 'folder-horizontal-open-sm.png',
+    MODE_TIMER: 'clock-select-sm.png',
+}
+
+
+class AutomatonDisplay(object):
+    '''
+    What the list shows for an automaton, taken when it is updated so painting
+    needs no config lookups (and their locks). Elided text is kept per width.
+    '''
+
+    __slots__ = ('notebooks', 'watched', 'output', 'mode_icon', 'is_active', 'is_running', 'success', 'latest_run', 'elided')
+
+    def __init__(self, automaton):
+        config = automaton.config
+        mode = config.get('mode')
+
+        self.notebooks = ";".join(config.get('notebook_paths'))
+        self.output = config.get('output_path')
+
+        if mode == MODE_WATCH_FILES:
+            self.watched = ";".join(config.get('watched_files'))
+        elif mode == MODE_WATCH_FOLDER:
+            self.watched = config.get('watched_folder')
+        elif mode == MODE_WATCH_FILE_EVENTS:
+            self.watched = "Each file in %s" % config.get('watched_folder')
+        elif mode == MODE_TIMER:
+            self.watched = "%s seconds(s)" % config.get('timer_seconds')
+        else:
+            self.watched = ''
+
+        self.mode_icon = MODE_ICONS.get(mode, MODE_ICONS[MODE_MANUAL])
+        self.is_active = config.get('is_active')
+        self.is_running = automaton.is_running
+        self.success = automaton.latest_run['success']
+
+        timestamp = automaton.latest_run['timestamp']
+        progress = automaton.progress() if self.is_running else None
+        if progress is not None and progress[1] > 1:
+            self.latest_run = "Running: %d of %d files" % progress
+        elif timestamp:
+            self.latest_run = "Latest run: %s" % timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            self.latest_run = None
+
+        self.elided = {}
+
+    def text(self, name, metrics, width):
+        key = (name, width)
+        if key not in self.elided:
+            self.elided[key] = metrics.elidedText(getattr(self, name), Qt.ElideMiddle, width)
+        return self.elided[key]
+
+
+class AutomatonListModel(QAbstractListModel):
+    '''
+    List model over an AutomatonRegistry.
+
+    Each row keeps an AutomatonDisplay. Changed automatons arrive from the status
+    bus in batches; their rows are rebuilt together and signalled as one
+    dataChanged per run of adjacent rows.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(AutomatonListModel, self).__init__(*args, **kwargs)
+
+        self.registry = AutomatonRegistry()
+        self.displays = []
+
+        get_status_bus().changed.connect(self.on_status_changed)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.registry)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == DISPLAY_ROLE:
+            return self.displays[index.row()]
+        elif role == Qt.UserRole:
+            return self.registry[index.row()]
+        return None
+
+    def automaton(self, row):
+        return self.registry[row]
+
+    def automatons(self):
+        return list(self.registry)
+
+    def add(self, automaton):
+        row = len(self.registry)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.registry.add(automaton)
+        self.displays.append(AutomatonDisplay(automaton))
+        self.endInsertRows()
+        return self.index(row)
+
+    def remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        automaton = self.registry.remove(row)
+        del self.displays[row]
+        self.endRemoveRows()
+        return automaton
+
+    def clear(self):
+        self.beginResetModel()
+        self.registry.clear()
+        self.displays = []
+        self.endResetModel()
+
+    def on_status_changed(self, automatons):
+        # Automatons removed from the list since publishing have no row
+        rows = sorted(set(self.registry.row(a) for a in automatons) - set([None]))
+
+        for row in rows:
+            self.displays[row] = AutomatonDisplay(self.registry[row])
+
+        # One dataChanged for each run of adjacent rows
+        start = None
+        for i, row in enumerate(rows):
+            if start is None:
+                start = row
+            if i + 1 == len(rows) or rows[i + 1] != row + 1:
+                self.dataChanged.emit(self.index(start), self.index(row))
+                start = None
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import os
+import json
+import hashlib
+import traceback
+
+from .qtcore import *
+from . import utils
+from .manifest import file_hash
+
+# Run variables that change on every trigger without changing what a notebook computes
+VOLATILE_VARS = ('datetime', 'date', 'time', 'output_path')
+
+
+def to_node(o):
+    from IPython.nbformat.current import NotebookNode
+
+    if isinstance(o, dict):
+        return NotebookNode({k: to_node(v) for k, v in o.items()})
+    elif isinstance(o, list):
+        return [to_node(v) for v in o]
+    return o
+
+
+def cell_source(cell):
+    return cell.get('input', cell.get('source', ''))
+
+
+class CellCache(object):
+    '''
+    Disk cache of cell outputs.
+
+    Each entry is a JSON file named by its key. Entries are touched on every hit,
+    and once the cache is larger than max_size bytes the least recently used are
+    removed. Input file hashes are memoised by (path, size, mtime) so unchanged
+    inputs are not re-read.
+    '''
+
+    def __init__(self, path, max_size=256 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+
+        self.mutex = QMutex()
+        self.entries = None  # key -> (size, last used), loaded on first use
+        self.total = 0
+        self.hashes = {}
+
+        utils.mkdir_p(self.path)
+
+    def _load_index(self):
+        self.entries = {}
+        self.total = 0
+        for f in os.listdir(self.path):
+            if f.endswith('.json'):
+                st = os.stat(os.path.join(self.path, f))
+                self.entries[f[:-5]] = (st.st_size, st.st_mtime)
+                self.total += st.st_size
+
+    def _file(self, key):
+        return os.path.join(self.path, '%s.json' % key)
+
+    def input_hash(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        stamp = (path, st.st_size, st.st_mtime)
+        with QMutexLocker(self.mutex):
+            h = self.hashes.get(stamp)
+
+        if h is None:
+            h = file_hash(path)
+            with QMutexLocker(self.mutex):
+                self.hashes[stamp] = h
+        return h
+
+    def context_key(self, vars, inputs):
+        '''
+        Key for everything outside the notebook that a run depends on: the injected
+        vars (less VOLATILE_VARS) and the contents of the input files.
+        '''
+        stable = {k: v for k, v in vars.items() if k not in VOLATILE_VARS}
+        h = hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode('utf-8'))
+        for path in sorted(inputs):
+            h.update(('%s:%s\n' % (path, self.input_hash(path))).encode('utf-8'))
+        return h.hexdigest()
+
+    def cell_keys(self, cells, context):
+        # Each key chains from the one before, so a changed cell also misses all cells below it
+        keys = []
+        k = context
+        for cell in cells:
+            k = hashlib.sha1((k + cell_source(cell)).encode('utf-8')).hexdigest()
+            keys.append(k)
+        return keys
+
+    def get(self, key):
+        with QMutexLocker(self.mutex):
+            if self.entries is None:
+                self._load_index()
+            if key not in self.entries:
+                return None
+
+        try:
+            with open(self._file(key), 'r') as f:
+                outputs = to_node(json.load(f))
+            os.utime(self._file(key), None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        with QMutexLocker(self.mutex):
+            if key in self.entries:
+                self.entries[key] = (self.entries[key][0], os.path.getmtime(self._file(key)))
+        return outputs
+
+    def put(self, key, outputs):
+        data = json.dumps(outputs, default=str)
+        try:
+            with open(self._file(key), 'w') as f:
+                f.write(data)
+            st = os.stat(self._file(key))
+        except (IOError, OSError):
+            logging.warning("Could not write cell cache entry:\n%s" % traceback.format_exc())
+            return
+
+        with QMutexLocker(self.mutex):
+            if self.entries is None:
+                self._load_index()
+            if key in self.entries:
+                self.total -= self.entries[key][0]
+            self.entries[key] = (st.st_size, st.st_mtime)
+            self.total += st.st_size
+
+        self.evict()
+
+    def evict(self):
+        remove = []
+        with QMutexLocker(self.mutex):
+            if self.total <= self.max_size:
+                return
+            for key, (size, used) in sorted(self.entries.items(), key=lambda e: e[1][1]):
+                if self.total <= self.max_size:
+                    break
+                del self.entries[key]
+                self.total -= size
+                remove.append(key)
+
+        for key in remove:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+
+    def run(self, runner, context, execute):
+        '''
+        Run the runner's notebook through the cache.
+
+        Skipping a cell would leave its variables undefined for the cells below it,
+        and keys are chained, so cached outputs are only used when every code cell
+        hits; the notebook then is not executed at all. Otherwise execute() is
+        called and, if it succeeds, the outputs of every cell are stored.
+        '''
+        cells = list(runner.iter_code_cells())
+        keys = self.cell_keys(cells, context)
+
+        hits = []
+        for k in keys:
+            outputs = self.get(k)
+            if outputs is None:
+                break
+            hits.append(outputs)
+
+        if len(hits) == len(cells):
+            logging.info('All %d cells cached; skipping execution' % len(cells))
+            for cell, outputs in zip(cells, hits):
+                cell['outputs'] = outputs
+            return
+
+        execute()
+
+        for cell, k in zip(cells, keys):
+            self.put(k, cell.get('outputs', []))
+
+
+_cache = None
+
+
+def get_cell_cache():
+    '''
+    Return the shared cell cache, creating it on first use.
+    '''
+    global _cache
+    if _cache is None:
+        _cache = CellCache(os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), 'cell-cache'))
+    return _cache
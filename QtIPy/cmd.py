@@ -1,5 +1,28 @@
-import QtIPy
+import sys
+import argparse
 
 
-def main():
-    QtIPy.main()
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='QtIPy', description='The data automator: auto-run IPython notebooks on file triggers.')
+    parser.add_argument('--headless', metavar='FILE', help='run the automatons in FILE (.qifx) without the GUI')
+    parser.add_argument('--control', nargs='+', metavar='ARG', help='send a command to a running headless QtIPy: list, or status|trigger|pause|enable ID')
+    parser.add_argument('--server', help='name of the headless control socket')
+    parser.add_argument('--profile-startup', action='store_true', help='report import and startup times to stderr once ready')
+    args, qt_args = parser.parse_known_args(argv)
+
+    if args.profile_startup:
+        from . import startup
+        startup.enable()
+
+    if args.control or args.headless:
+        from . import headless
+        server_name = args.server or headless.DEFAULT_SERVER_NAME
+
+        if args.control:
+            sys.exit(headless.control(args.control[0], args.control[1] if len(args.control) > 1 else None, server_name))
+
+        sys.exit(headless.main(args.headless, server_name, sys.argv[:1] + qt_args))
+
+    else:
+        from . import QtIPy
+        QtIPy.main(sys.argv[:1] + qt_args)
@@ -11,7 +11,6 @@ import os
 import sys
 import re
 import base64
-import numpy as np
 import types
 
 from collections import defaultdict, OrderedDict
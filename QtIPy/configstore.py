@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .qtcore import *
+
+from pyqtconfig import ConfigManager, QSettingsManager, RECALCULATE_ALL
+
+
+class RunSpec(object):
+    '''
+    Read-only view of a config at one point in time, as returned by
+    SnapshotConfigManager.freeze(). Later changes to the config do not show.
+    '''
+
+    __slots__ = ('_values', )
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def items(self):
+        return self._values.items()
+
+    def as_dict(self):
+        return dict(self._values)
+
+
+class SnapshotConfigManager(ConfigManager):
+    '''
+    ConfigManager with lock-free reads.
+
+    Alongside config and defaults it keeps a merged snapshot of both, which is
+    replaced (never modified) under the mutex whenever either changes. get() is
+    then a single lookup in the current snapshot, and freeze() can hand the
+    snapshot out without copying.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.snapshot = {}
+        super(SnapshotConfigManager, self).__init__(*args, **kwargs)
+        self._rebuild()
+
+    def _rebuild(self):
+        with QMutexLocker(self.mutex):
+            snapshot = dict(self.defaults)
+            snapshot.update((k, v) for k, v in self.config.items() if v is not None)
+            self.snapshot = snapshot
+
+    def _get(self, key):
+        return self.config.get(key)
+
+    def _set(self, key, value):
+        with QMutexLocker(self.mutex):
+            self.config[key] = value
+            snapshot = dict(self.snapshot)
+            snapshot[key] = value if value is not None else self.defaults.get(key)
+            self.snapshot = snapshot
+
+    def get(self, key):
+        return self.snapshot.get(key)
+
+    def freeze(self):
+        '''
+        Return a RunSpec of the current config, including defaults.
+        '''
+        return RunSpec(self.snapshot)
+
+    # Defaults are applied to the snapshot before listeners are told of the change
+    def set_default(self, key, value, eventhook=RECALCULATE_ALL):
+        self.set_defaults({key: value}, eventhook)
+
+    def set_defaults(self, keyvalues, eventhook=RECALCULATE_ALL):
+        for key, value in list(keyvalues.items()):
+            self.defaults[key] = value
+            self.eventhooks[key] = eventhook
+
+        self._rebuild()
+        self.updated.emit(eventhook)
+
+    def replace(self, keyvalues, *args, **kwargs):
+        self.config = {}
+        self._rebuild()
+        self.set_many(keyvalues)
+
+    def reset(self):
+        super(SnapshotConfigManager, self).reset()
+        self.snapshot = {}
+
+
+class CachedSettingsManager(QSettingsManager):
+    '''
+    QSettingsManager that reads each key from QSettings once and writes behind.
+
+    Values are read, and coerced to the type of their default, on first use and
+    then served from memory. Changed keys are written together flush_interval ms
+    after the first change, followed by a single sync(); call flush() before
+    exiting to write any still pending. set() should be called on the GUI thread.
+    '''
+
+    def __init__(self, flush_interval=2000, *args, **kwargs):
+        super(CachedSettingsManager, self).__init__(*args, **kwargs)
+
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def reset(self):
+        super(CachedSettingsManager, self).reset()
+        self.cache = {}
+        self.dirty = set()
+
+    def _get(self, key):
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+
+        v = super(CachedSettingsManager, self)._get(key)
+        with QMutexLocker(self.mutex):
+            self.cache.setdefault(key, v)
+            return self.cache[key]
+
+    def _set(self, key, value):
+        with QMutexLocker(self.mutex):
+            self.cache[key] = value
+            self.dirty.add(key)
+
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def get(self, key):
+        v = self._get(key)
+        if v is not None:
+            return v
+        return self.defaults.get(key)
+
+    def set_defaults(self, keyvalues, *args, **kwargs):
+        # Values read before their default was known were not coerced to its type
+        with QMutexLocker(self.mutex):
+            for key in keyvalues:
+                if key not in self.dirty:
+                    self.cache.pop(key, None)
+
+        super(CachedSettingsManager, self).set_defaults(keyvalues, *args, **kwargs)
+
+    def flush(self):
+        '''
+        Write changed values to QSettings and sync it to disk.
+        '''
+        self.flush_timer.stop()
+        with QMutexLocker(self.mutex):
+            if not self.dirty:
+                return
+            for key in self.dirty:
+                self.settings.setValue(key, self.cache[key])
+            self.dirty = set()
+            self.settings.sync()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import sys
+import traceback
+
+from collections import deque
+
+from .qtcore import *
+
+
+class JobSignals(QObject):
+    '''
+    Signals emitted by a running job.
+
+    Jobs run on pool threads, so anything connected here from the GUI thread is
+    delivered as a queued call and may safely touch widgets and models.
+    '''
+    started = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(object, tuple)
+    result = pyqtSignal(object, object)
+
+
+class Job(QRunnable):
+    '''
+    A unit of work for the execution engine: calls fn(*args, **kwargs) on a pool
+    thread and reports back through signals.
+
+    The optional owner is used to find (and cancel) queued jobs, e.g. when an
+    automaton is paused or deleted.
+    '''
+
+    def __init__(self, fn, *args, **kwargs):
+        super(Job, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.owner = None
+        self.signals = JobSignals()
+        # Lifetime is managed from Python (the engine holds active jobs)
+        self.setAutoDelete(False)
+
+    def run(self):
+        self.signals.started.emit(self)
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except:
+            exctype, value = sys.exc_info()[:2]
+            logging.error("%s\n%s\n%s" % (exctype, value, traceback.format_exc()))
+            self.signals.error.emit(self, (exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(self, result)
+        finally:
+            self.signals.finished.emit(self)
+
+
+class ExecutionEngine(QObject):
+    '''
+    Job queue feeding a QThreadPool of notebook runs.
+
+    Jobs are held in our own queue and only handed to the pool while fewer than
+    max_concurrent are active, so the limit can be changed at runtime and queued
+    jobs can be cancelled. All methods must be called from the GUI thread, except
+    reserve() and unreserve(); completion is reported back to it via queued signals.
+
+    A running job may borrow free slots with reserve() for threads of its own
+    (e.g. to process files in parallel); those count towards max_concurrent until
+    given back.
+    '''
+
+    job_started = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+    _wake = pyqtSignal()
+
+    def __init__(self, max_concurrent=None, *args, **kwargs):
+        super(ExecutionEngine, self).__init__(*args, **kwargs)
+
+        self.pool = QThreadPool()
+        self.queue = deque()
+        self.active = set()
+        self.mutex = QMutex()
+        self.reserved = 0
+
+        self.max_concurrent = 1
+        self.set_max_concurrent(max_concurrent or QThread.idealThreadCount())
+
+        self._wake.connect(self._dispatch, Qt.QueuedConnection)
+
+    def set_max_concurrent(self, n):
+        self.max_concurrent = max(1, int(n))
+        if self.pool.maxThreadCount() < self.max_concurrent:
+            self.pool.setMaxThreadCount(self.max_concurrent)
+        logging.debug('Execution engine running up to %d jobs' % self.max_concurrent)
+        self._dispatch()
+
+    def submit(self, job):
+        job.signals.finished.connect(self._on_job_finished)
+        self.queue.append(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, owner, jobs=None):
+        '''
+        Drop queued (not yet started) jobs for the given owner: all of them, or
+        only those in jobs. Returns the number dropped.
+        '''
+        n = len(self.queue)
+        self.queue = deque(j for j in self.queue if j.owner is not owner or (jobs is not None and j not in jobs))
+        return n - len(self.queue)
+
+    def _free(self):
+        return self.max_concurrent - len(self.active) - self.reserved
+
+    def reserve(self, n):
+        '''
+        Borrow up to n free slots; returns the number granted. May be called from
+        any thread. Hand them back with unreserve().
+        '''
+        with QMutexLocker(self.mutex):
+            n = max(0, min(n, self._free()))
+            self.reserved += n
+        return n
+
+    def unreserve(self, n):
+        if n:
+            with QMutexLocker(self.mutex):
+                self.reserved -= n
+            # Queued jobs may now fit; dispatch on the GUI thread
+            self._wake.emit()
+
+    def _dispatch(self):
+        while True:
+            with QMutexLocker(self.mutex):
+                if not self.queue or self._free() <= 0:
+                    break
+                job = self.queue.popleft()
+                self.active.add(job)
+            self.job_started.emit(job)
+            self.pool.start(job)
+
+    def _on_job_finished(self, job):
+        self.active.discard(job)
+        self.job_finished.emit(job)
+        self._dispatch()
+
+    def pending(self):
+        return len(self.queue)
+
+    def running(self):
+        return len(self.active)
+
+    def shutdown(self):
+        '''
+        Discard queued jobs and wait for the active ones to complete.
+        '''
+        self.queue.clear()
+        self.pool.waitForDone()
+
+
+_engine = None
+
+
+def get_engine():
+    '''
+    Return the shared execution engine, creating it on first use.
+    '''
+    global _engine
+    if _engine is None:
+        _engine = ExecutionEngine()
+    return _engine
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import io
+import sys
+import threading
+import traceback
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from .runlog import run_context, current_run
+
+# Raw notebook output; written directly without going through nbconvert
+FORMAT_NOTEBOOK = 'ipynb'
+
+EXPORT_EXTENSIONS = dict(
+    html='html',
+    slides='slides',
+    latex='latex',
+    markdown='md',
+    python='py',
+    rst='rst',
+    ipynb='ipynb',
+)
+
+# Listed statically so nbconvert is only imported when the first export happens
+EXPORT_FORMATS = sorted(EXPORT_EXTENSIONS.keys())
+
+
+class ExportTicket(object):
+    '''
+    Handle for a queued export; wait() blocks until it is written and returns
+    whether it succeeded.
+    '''
+
+    def __init__(self, nb, output_format, output_path):
+        self.nb = nb
+        self.output_format = output_format
+        self.output_path = output_path
+
+        self.done = threading.Event()
+        self.success = None
+        # Log the export to the run that queued it
+        self.automaton_id, self.run_id = current_run()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.success
+
+
+class ExportPipeline(object):
+    '''
+    Export stage for executed notebooks.
+
+    Notebooks are queued and converted/written by a set of worker threads, so a
+    run can start on its next file while the previous one is exported. Each worker
+    keeps one exporter instance per format, so templates are loaded only once.
+    '''
+
+    def __init__(self, workers=2):
+        self.queue = Queue()
+        self.local = threading.local()
+
+        self.workers = []
+        for _ in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, nb, output_format, output_path):
+        ticket = ExportTicket(nb, output_format, output_path)
+        self.queue.put(ticket)
+        return ticket
+
+    def get_exporter(self, output_format):
+        if not hasattr(self.local, 'exporters'):
+            self.local.exporters = {}
+
+        if output_format not in self.local.exporters:
+            from IPython.nbconvert.exporters.export import exporter_map as IPyexporter_map
+            self.local.exporters[output_format] = IPyexporter_map[output_format]()
+        return self.local.exporters[output_format]
+
+    def export(self, ticket):
+        if ticket.output_format == FORMAT_NOTEBOOK:
+            from IPython.nbformat.current import writes
+            output = writes(ticket.nb, 'json')
+        else:
+            output, resources = self.get_exporter(ticket.output_format).from_notebook_node(ticket.nb)
+
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+
+        logging.info("Exporting updated notebook to %s" % ticket.output_path)
+        with io.open(ticket.output_path, 'w', encoding='utf-8') as f:
+            f.write(output)
+
+    def _work(self):
+        while True:
+            ticket = self.queue.get()
+            if ticket is None:
+                break
+
+            try:
+                if ticket.run_id is not None:
+                    with run_context(ticket.automaton_id, ticket.run_id):
+                        self.export(ticket)
+                else:
+                    self.export(ticket)
+            except:
+                ticket.success = False
+                exctype, value = sys.exc_info()[:2]
+                logging.error("%s\n%s\n%s" % (exctype, value, traceback.format_exc()))
+            else:
+                ticket.success = True
+            finally:
+                ticket.nb = None
+                ticket.done.set()
+                self.queue.task_done()
+
+    def shutdown(self):
+        '''
+        Finish queued exports and stop the workers.
+        '''
+        for _ in self.workers:
+            self.queue.put(None)
+        for t in self.workers:
+            t.join()
+
+
+_pipeline = None
+
+
+def get_export_pipeline():
+    '''
+    Return the shared export pipeline, creating it on first use.
+    '''
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ExportPipeline()
+    return _pipeline
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import os
+
+from .qtcore import *
+from .engine import Job
+from .manifest import file_hash
+
+# Changed files up to this size are hashed on the spot; larger ones, and baselines, on the hashing thread
+INLINE_HASH_SIZE = 4 * 1024 * 1024
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+def _hash(path):
+    try:
+        return file_hash(path)
+    except (IOError, OSError):
+        return None
+
+
+class ContentChangeFilter(QObject):
+    '''
+    Passes on only the files whose content has actually changed.
+
+    A fingerprint of (size, mtime, hash) is kept for each file. A change of size
+    is a change of content; the same size and mtime is none (e.g. a change of
+    permissions); otherwise the content is hashed and compared. Large files, and
+    the baseline taken by reset(), are hashed on a background thread, and a
+    result is dropped if the file has changed again since, as the later check
+    will decide.
+
+    changed is emitted with lists of paths. Must be used from the thread it
+    belongs to.
+    '''
+
+    changed = pyqtSignal(list)
+
+    def __init__(self, *args, **kwargs):
+        super(ContentChangeFilter, self).__init__(*args, **kwargs)
+        self.fingerprints = {}  # path -> (size, mtime, hash or None while hashing)
+        self.generation = {}  # path -> number of the latest check, to spot stale hashes
+        self.jobs = set()
+
+        # Hashing is disk-bound; one file at a time
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def reset(self, paths):
+        '''
+        Forget all fingerprints and take new ones for paths, as the baseline. Only
+        the stat is taken here; the hashing is done in the background.
+        '''
+        self.fingerprints = {}
+        self.generation = {}
+        for path in paths:
+            state = _stat(path)
+            if state is not None:
+                self._fingerprint(path, state, None, inline=False)
+
+    def _fingerprint(self, path, state, previous_hash, inline=True):
+        # Record the new state, hashing it (inline or in the background) for the next comparison
+        generation = self.generation.get(path, 0) + 1
+        self.generation[path] = generation
+
+        if inline and state[0] <= INLINE_HASH_SIZE:
+            h = _hash(path)
+            self.fingerprints[path] = state + (h, )
+            return h
+
+        self.fingerprints[path] = state + (None, )
+        job = Job(_hash, path)
+        job.signals.result.connect(lambda job, h: self.on_hashed(path, generation, state, previous_hash, h))
+        job.signals.finished.connect(self.jobs.discard)
+        self.jobs.add(job)
+        self.pool.start(job)
+
+    def add(self, paths):
+        changed = []
+        for path in paths:
+            state = _stat(path)
+            previous = self.fingerprints.get(path)
+            if state is None:
+                # Removed; anything that appears there next is new
+                self.fingerprints.pop(path, None)
+                continue
+
+            if previous is not None and previous[:2] == state:
+                continue
+
+            if previous is None or previous[0] != state[0] or previous[2] is None:
+                # New, different size, or no hash to compare against yet
+                self._fingerprint(path, state, None)
+                changed.append(path)
+                continue
+
+            if state[0] > INLINE_HASH_SIZE:
+                # Compared once hashed, in on_hashed
+                self._fingerprint(path, state, previous[2])
+                continue
+
+            h = self._fingerprint(path, state, previous[2])
+            if h is None or h != previous[2]:
+                changed.append(path)
+            else:
+                logging.debug('%s rewritten with identical content; ignored' % path)
+
+        if changed:
+            self.changed.emit(changed)
+
+    def on_hashed(self, path, generation, state, previous_hash, h):
+        if self.generation.get(path) != generation:
+            return  # Changed again while hashing
+
+        self.fingerprints[path] = state + (h, )
+        if previous_hash is None:
+            return  # Baseline only; the change (if any) has been passed on already
+
+        if h is None or h != previous_hash:
+            self.changed.emit([path])
+        else:
+            logging.debug('%s rewritten with identical content; ignored' % path)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import sys
+import json
+import signal
+import getpass
+
+from .qtcore import *
+from .automaton import load_automatons
+from .registry import AutomatonRegistry
+from .engine import get_engine
+from .kernels import get_kernel_pool
+from .export import get_export_pipeline
+from .settings import get_settings, apply_settings
+from .runlog import install_run_log, shutdown_run_log
+from . import startup
+
+DEFAULT_SERVER_NAME = 'qtipy-%s' % getpass.getuser()
+
+COMMANDS = ('list', 'status', 'trigger', 'pause', 'enable')
+
+
+class DaemonError(Exception):
+    pass
+
+
+def server_running(server_name, timeout=1000):
+    '''
+    Return True if a server (e.g. another daemon) is listening on server_name.
+    '''
+    socket = QLocalSocket()
+    socket.connectToServer(server_name)
+    if socket.waitForConnected(timeout):
+        socket.disconnectFromServer()
+        return True
+    return False
+
+
+class Daemon(QObject):
+    '''
+    Runs a set of automatons without a GUI, controlled through a local socket.
+
+    The socket takes one JSON request per line, {"command": ..., "id": ...}, and
+    writes one JSON response per line. id may be an automaton_id or a list index.
+
+    Raises DaemonError if another daemon is already listening on server_name.
+    '''
+
+    def __init__(self, filename, server_name=DEFAULT_SERVER_NAME, *args, **kwargs):
+        super(Daemon, self).__init__(*args, **kwargs)
+        if server_running(server_name):
+            raise DaemonError('Another QtIPy daemon is already running on %s' % server_name)
+
+        self.automatons = AutomatonRegistry()
+        for automaton in load_automatons(filename):
+            self.automatons.add(automaton)
+        logging.info('Loaded %d automatons from %s' % (len(self.automatons), filename))
+
+        for automaton in self.automatons:
+            automaton.startup()
+
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        # Nothing answered, so any socket left is stale, from a daemon that did not exit cleanly
+        QLocalServer.removeServer(server_name)
+        if self.server.listen(server_name):
+            logging.info('Listening for control commands on %s' % self.server.fullServerName())
+        else:
+            logging.error('Could not open control socket %s: %s' % (server_name, self.server.errorString()))
+        self.server.newConnection.connect(self.on_new_connection)
+
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.on_ready_read(socket))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def on_ready_read(self, socket):
+        while socket.canReadLine():
+            line = bytes(socket.readLine()).decode('utf-8').strip()
+            if line:
+                response = self.handle(line)
+                socket.write((json.dumps(response) + '\n').encode('utf-8'))
+
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+            command = request['command']
+        except (ValueError, TypeError, KeyError):
+            return {'error': 'Invalid request'}
+
+        if command not in COMMANDS:
+            return {'error': 'Unknown command %s' % command}
+
+        if command == 'list':
+            return {'automatons': [a.status() for a in self.automatons]}
+
+        automaton = self.automatons.find(request.get('id'))
+        if automaton is None:
+            return {'error': 'No automaton %s' % request.get('id')}
+
+        if command == 'trigger':
+            automaton.trigger(immediate=True)
+
+        elif command == 'pause':
+            automaton.config.set('is_active', False)
+            automaton.cancel()
+            automaton.shutdown()
+
+        elif command == 'enable':
+            automaton.config.set('is_active', True)
+            automaton.startup()
+
+        return automaton.status()
+
+    def shutdown(self):
+        self.server.close()
+        for automaton in self.automatons:
+            automaton.cancel()
+            automaton.shutdown()
+
+
+def send_command(command, id=None, server_name=DEFAULT_SERVER_NAME, timeout=5000):
+    '''
+    Send a command to a running daemon and return its (decoded) response.
+    '''
+    socket = QLocalSocket()
+    socket.connectToServer(server_name)
+    if not socket.waitForConnected(timeout):
+        raise IOError('Could not connect to %s: %s' % (server_name, socket.errorString()))
+
+    request = {'command': command}
+    if id is not None:
+        request['id'] = id
+    socket.write((json.dumps(request) + '\n').encode('utf-8'))
+    socket.waitForBytesWritten(timeout)
+
+    while not socket.canReadLine():
+        if not socket.waitForReadyRead(timeout):
+            raise IOError('No response from %s' % server_name)
+
+    response = json.loads(bytes(socket.readLine()).decode('utf-8'))
+    socket.disconnectFromServer()
+    return response
+
+
+def control(command, id=None, server_name=DEFAULT_SERVER_NAME):
+    # Blocking socket calls only; no application or event loop is needed
+    try:
+        response = send_command(command, id, server_name)
+    except IOError as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+
+    sys.stdout.write(json.dumps(response, indent=2) + '\n')
+    return 1 if 'error' in response else 0
+
+
+def main(filename, server_name=DEFAULT_SERVER_NAME, argv=None):
+    startup.mark('imports')
+    logging.basicConfig(level=logging.INFO)
+
+    app = QCoreApplication(argv or sys.argv)
+    app.setOrganizationName("QtIPy")
+    app.setOrganizationDomain("martinfitzpatrick.name")
+    app.setApplicationName("QtIPy")
+
+    install_run_log()
+    apply_settings()
+
+    try:
+        daemon = Daemon(filename, server_name)
+    except DaemonError as e:
+        logging.error('%s' % e)
+        shutdown_run_log()
+        return 1
+
+    get_kernel_pool().start()
+    startup.mark('automatons loaded')
+    QTimer.singleShot(0, startup.report)
+
+    # Let Python handle SIGINT/SIGTERM: its handlers only run while Python code
+    # is executing, so wake the interpreter regularly from the Qt event loop
+    signal.signal(signal.SIGINT, lambda *args: app.quit())
+    signal.signal(signal.SIGTERM, lambda *args: app.quit())
+    tick = QTimer()
+    tick.timeout.connect(lambda: None)
+    tick.start(500)
+
+    logging.info('Ready.')
+    app.exec_()
+    logging.info('Exiting.')
+
+    daemon.shutdown()
+    get_engine().shutdown()
+    get_kernel_pool().shutdown()
+    get_export_pipeline().shutdown()
+    get_settings().flush()
+    shutdown_run_log()
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import json
+import time
+import threading
+import traceback
+
+from .qtcore import *
+from .notebooks import is_setup_cell
+
+# Run between leases: clear the user namespace; pylab is re-applied as the
+# kernel was started with it and notebooks may rely on its names
+RESET_CODE = '%reset -f'
+PYLAB_CODE = '%pylab inline'
+
+
+class KernelError(Exception):
+    pass
+
+
+def execute_silently(runner, code, timeout=60):
+    '''
+    Execute code on the runner's kernel without adding to the notebook or history.
+
+    The iopub channel is drained up to the kernel returning to idle so the next
+    NotebookRunner.run_cell does not pick up our status messages.
+    '''
+    msg_id = runner.kc.execute(code, silent=True, store_history=False)
+
+    while True:
+        reply = runner.kc.get_shell_msg(timeout=timeout)
+        if reply['parent_header'].get('msg_id') == msg_id:
+            break
+
+    while True:
+        msg = runner.kc.get_iopub_msg(timeout=timeout)
+        if msg['parent_header'].get('msg_id') == msg_id and \
+           msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+            break
+
+    if reply['content']['status'] != 'ok':
+        raise KernelError("%s: %s" % (reply['content'].get('ename'), reply['content'].get('evalue')))
+
+    return reply
+
+
+def inject_vars(runner, vars, name='qtipy'):
+    '''
+    Set a dict of vars in the kernel namespace with a single silent execute.
+
+    The vars are sent as JSON, parsed in the kernel and kept as a base copy; later
+    calls on the same kernel send only keys that changed or were removed. Each call
+    binds name to a fresh copy of the base, so changes a notebook makes to it do not
+    carry over to the next run.
+    '''
+    sent = getattr(runner, 'injected_vars', None)
+
+    if sent is None:
+        code = '__qtipy_base = __import__("json").loads(%r)\n' % json.dumps(vars, default=str)
+    else:
+        changed = {k: v for k, v in vars.items() if k not in sent or sent[k] != v}
+        removed = [k for k in sent if k not in vars]
+        code = ''
+        if changed:
+            code += '__qtipy_base.update(__import__("json").loads(%r))\n' % json.dumps(changed, default=str)
+        for k in removed:
+            code += '__qtipy_base.pop(%r, None)\n' % k
+
+    code += '%s = dict(__qtipy_base)' % name
+    execute_silently(runner, code)
+    runner.injected_vars = dict(vars)
+
+
+def run_batch(runner, key):
+    '''
+    Run the runner's notebook, executing setup cells only once per kernel session.
+
+    The first time a notebook (identified by key) runs on a kernel all cells run in
+    order, and once the setup cells have all succeeded their outputs are kept.
+    Later runs of the same notebook on that kernel skip the setup cells, which are
+    given the kept outputs so the exported notebook is complete.
+    '''
+    if getattr(runner, 'setup_outputs', None) is None:
+        runner.setup_outputs = {}
+
+    kept = runner.setup_outputs.get(key)
+    setup_cells = [cell for cell in runner.iter_code_cells() if is_setup_cell(cell)]
+
+    if kept is not None:
+        for cell, outputs in zip(setup_cells, kept):
+            cell['outputs'] = outputs
+
+    for cell in runner.iter_code_cells():
+        if is_setup_cell(cell):
+            if kept is not None:
+                continue
+
+            runner.run_cell(cell)
+            if cell is setup_cells[-1]:
+                # All setup cells ran without error; don't repeat them on this kernel
+                runner.setup_outputs[key] = [c.get('outputs', []) for c in setup_cells]
+
+        else:
+            runner.run_cell(cell)
+
+
+class KernelPool(QObject):
+    '''
+    A shared pool of warm notebook kernels.
+
+    min_size kernels are started up front (in the background) and kept alive;
+    up to max_size are started on demand. Runs lease a kernel, and on release
+    its namespace is reset, or the kernel replaced if it was left dirty, before
+    it is returned to the pool. Kernels above min_size that sit idle for longer
+    than idle_timeout seconds are shut down.
+
+    lease() blocks, so must be called from a run thread, not the GUI thread.
+    '''
+
+    def __init__(self, min_size=1, max_size=4, idle_timeout=300, pylab=True, mpl_inline=True, *args, **kwargs):
+        super(KernelPool, self).__init__(*args, **kwargs)
+
+        self.mutex = QMutex()
+        self.available = QWaitCondition()
+
+        self.idle = []  # (runner, released_at), most recently used last
+        self.leased = set()
+        self.starting = 0
+
+        self.pylab = pylab
+        self.mpl_inline = mpl_inline
+
+        self.min_size = 0
+        self.max_size = 1
+        self.idle_timeout = idle_timeout
+        self.configure(min_size, max_size, idle_timeout)
+
+        self.eviction_timer = QTimer()
+        self.eviction_timer.timeout.connect(self.evict_idle)
+        self.eviction_timer.start(30 * 1000)
+
+    def configure(self, min_size, max_size, idle_timeout):
+        with QMutexLocker(self.mutex):
+            self.max_size = max(1, max_size)
+            self.min_size = max(0, min(min_size, self.max_size))
+            self.idle_timeout = idle_timeout
+            self.available.wakeAll()
+
+    def size(self):
+        return len(self.idle) + len(self.leased) + self.starting
+
+    def _new_runner(self):
+        # Imported on first use; loading the kernel machinery is slow
+        from runipy.notebook_runner import NotebookRunner
+
+        t = time.time()
+        runner = NotebookRunner(None, pylab=self.pylab, mpl_inline=self.mpl_inline)
+        logging.debug('Started kernel in %.2fs' % (time.time() - t))
+        return runner
+
+    def _shutdown_runner(self, runner):
+        try:
+            runner.shutdown_kernel()
+        except:
+            logging.warning("Kernel did not shut down cleanly:\n%s" % traceback.format_exc())
+
+    def start(self):
+        '''
+        Pre-start kernels up to min_size in the background.
+        '''
+        with QMutexLocker(self.mutex):
+            n = self.min_size - self.size()
+            self.starting += max(0, n)
+
+        for _ in range(n):
+            t = threading.Thread(target=self._prestart)
+            t.daemon = True
+            t.start()
+
+    def _prestart(self):
+        try:
+            runner = self._new_runner()
+        except:
+            logging.error("Could not start kernel:\n%s" % traceback.format_exc())
+            with QMutexLocker(self.mutex):
+                self.starting -= 1
+                self.available.wakeAll()
+            return
+
+        with QMutexLocker(self.mutex):
+            self.starting -= 1
+            self.idle.append((runner, time.time()))
+            self.available.wakeAll()
+
+    def lease(self, timeout=None):
+        '''
+        Take a kernel from the pool, starting a new one if none is idle and the pool
+        is below max_size, otherwise waiting for one to be released.
+        '''
+        with QMutexLocker(self.mutex):
+            while True:
+                if self.idle:
+                    runner, _ = self.idle.pop()
+                    self.leased.add(runner)
+                    return runner
+
+                if self.size() < self.max_size:
+                    self.starting += 1
+                    break
+
+                if timeout is None:
+                    self.available.wait(self.mutex)
+                elif not self.available.wait(self.mutex, int(timeout * 1000)):
+                    raise KernelError('Timed out waiting for a kernel')
+
+        try:
+            runner = self._new_runner()
+        except:
+            with QMutexLocker(self.mutex):
+                self.starting -= 1
+                self.available.wakeAll()
+            raise
+
+        with QMutexLocker(self.mutex):
+            self.starting -= 1
+            self.leased.add(runner)
+        return runner
+
+    def release(self, runner, dirty=False):
+        '''
+        Return a leased kernel to the pool. The namespace is cleared; a dirty kernel
+        (or one that fails to reset) is replaced with a fresh one.
+        '''
+        if not dirty and not runner.km.is_alive():
+            dirty = True
+
+        if not dirty:
+            try:
+                execute_silently(runner, RESET_CODE + ('\n' + PYLAB_CODE if self.pylab else ''))
+            except:
+                logging.warning("Kernel reset failed; restarting:\n%s" % traceback.format_exc())
+                dirty = True
+
+        # The namespace is being cleared, so the next injection must send everything
+        runner.injected_vars = None
+        runner.setup_outputs = None
+
+        leased = runner
+        if dirty:
+            self._shutdown_runner(runner)
+            try:
+                runner = self._new_runner()
+            except:
+                with QMutexLocker(self.mutex):
+                    self.leased.discard(leased)
+                    self.available.wakeAll()
+                raise
+
+        with QMutexLocker(self.mutex):
+            self.leased.discard(leased)
+            self.idle.append((runner, time.time()))
+            self.available.wakeAll()
+
+    def evict_idle(self):
+        '''
+        Shut down kernels idle for longer than idle_timeout, keeping at least min_size.
+        '''
+        evict = []
+        with QMutexLocker(self.mutex):
+            cutoff = time.time() - self.idle_timeout
+            # Oldest first
+            while self.idle and self.size() > self.min_size and self.idle[0][1] < cutoff:
+                evict.append(self.idle.pop(0)[0])
+
+        if evict:
+            # Called from the timer on the GUI thread; shutting a kernel down blocks
+            t = threading.Thread(target=self._evict, args=(evict, ))
+            t.daemon = True
+            t.start()
+
+    def _evict(self, runners):
+        for runner in runners:
+            logging.debug('Evicting idle kernel')
+            self._shutdown_runner(runner)
+
+    def shutdown(self):
+        self.eviction_timer.stop()
+        with QMutexLocker(self.mutex):
+            runners = [r for r, _ in self.idle]
+            self.idle = []
+
+        for runner in runners:
+            self._shutdown_runner(runner)
+
+
+_pool = None
+
+
+def get_kernel_pool():
+    '''
+    Return the shared kernel pool, creating it on first use.
+    '''
+    global _pool
+    if _pool is None:
+        _pool = KernelPool()
+    return _pool
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import threading
+
+from .qt import *
+from .translate import tr
+
+LOG_COLORS = {
+    logging.CRITICAL: QColor(164, 0, 0),
+    logging.ERROR: QColor(239, 41, 41),
+    logging.WARNING: QColor(196, 160, 0),
+    logging.INFO: QColor(0, 0, 0),
+    logging.DEBUG: QColor(114, 159, 207),
+    logging.NOTSET: QColor(0, 0, 0),
+}
+
+LOG_LEVELS = (
+    ('Debug', logging.DEBUG),
+    ('Info', logging.INFO),
+    ('Warning', logging.WARNING),
+    ('Error', logging.ERROR),
+)
+
+# Records are added to the view at most this often
+LOG_FLUSH_INTERVAL = 100  # ms
+
+
+class LogModel(QAbstractListModel):
+    '''
+    Fixed-capacity list of (level, line) log rows.
+
+    Once retention rows are held, the oldest are dropped as new ones arrive. Rows
+    are only appended or dropped from the front, so views update incrementally.
+
+    Rows live in a list from offset head on; dropping rows only moves head, and
+    the dead rows are cut off in one go once they are half the list. Indexing a
+    row is then O(1) wherever it is, as views and the level filter need.
+    '''
+
+    def __init__(self, retention=100000, *args, **kwargs):
+        super(LogModel, self).__init__(*args, **kwargs)
+        self.rows = []
+        self.head = 0
+        self.retention = retention
+
+    def __len__(self):
+        return len(self.rows) - self.head
+
+    def row(self, i):
+        return self.rows[self.head + i]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        levelno, msg = self.rows[self.head + index.row()]
+        if role == Qt.DisplayRole:
+            return msg
+        elif role == Qt.ForegroundRole:
+            return LOG_COLORS.get(levelno, LOG_COLORS[logging.NOTSET])
+        elif role == Qt.UserRole:
+            return levelno
+        return None
+
+    def _trim(self, n):
+        n = min(n, len(self))
+        if n <= 0:
+            return
+        self.beginRemoveRows(QModelIndex(), 0, n - 1)
+        self.head += n
+        if self.head * 2 > len(self.rows):
+            del self.rows[:self.head]
+            self.head = 0
+        self.endRemoveRows()
+
+    def append(self, records):
+        records = records[-self.retention:] if self.retention else []
+        if not records:
+            return
+
+        self._trim(len(self) + len(records) - self.retention)
+
+        first = len(self)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        self.rows.extend(records)
+        self.endInsertRows()
+
+    def set_retention(self, retention):
+        self.retention = retention
+        self._trim(len(self) - retention)
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.head = 0
+        self.endResetModel()
+
+
+class LogLevelFilter(QSortFilterProxyModel):
+
+    def __init__(self, *args, **kwargs):
+        super(LogLevelFilter, self).__init__(*args, **kwargs)
+        self.level = logging.NOTSET
+
+    def set_level(self, level):
+        self.level = level
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        return self.sourceModel().row(row)[0] >= self.level
+
+
+class LogHandler(logging.Handler):
+    '''
+    Logging handler feeding a LogModel.
+
+    emit() may be called from any thread and only queues the formatted record.
+    Queued records are added to the model in one batch per LOG_FLUSH_INTERVAL by
+    a timer on the GUI thread, so a burst of logging costs one view update.
+    '''
+
+    def __init__(self, model):
+        super(LogHandler, self).__init__()
+        self.model = model
+
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.flush_pending)
+        self.timer.start(LOG_FLUSH_INTERVAL)
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        # One row per line, so rows have a uniform height (tracebacks span several)
+        rows = [(record.levelno, line) for line in msg.splitlines()]
+        with self.pending_lock:
+            self.pending.extend(rows)
+
+    def flush_pending(self):
+        with self.pending_lock:
+            if not self.pending:
+                return
+            records, self.pending = self.pending, []
+
+        self.model.append(records)
+
+
+class LogView(QWidget):
+    '''
+    Log tab: the log rows with a minimum level selector. Follows new rows while
+    scrolled to the bottom.
+    '''
+
+    def __init__(self, model, *args, **kwargs):
+        super(LogView, self).__init__(*args, **kwargs)
+
+        self.model = model
+        self.filter = LogLevelFilter(self)
+        self.filter.setSourceModel(model)
+
+        self.view = QListView()
+        self.view.setModel(self.filter)
+        self.view.setUniformItemSizes(True)
+        self.view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.view.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+
+        self.level_cb = QComboBox()
+        for name, level in LOG_LEVELS:
+            self.level_cb.addItem(tr(name), level)
+        self.level_cb.currentIndexChanged.connect(self.on_level_changed)
+
+        clear_btn = QPushButton(tr('Clear'))
+        clear_btn.clicked.connect(model.clear)
+
+        bar = QHBoxLayout()
+        bar.addWidget(QLabel(tr('Show')))
+        bar.addWidget(self.level_cb)
+        bar.addStretch()
+        bar.addWidget(clear_btn)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(bar)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        self.follow = True
+        self.view.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+        self.view.verticalScrollBar().rangeChanged.connect(self.on_range_changed)
+
+    def on_level_changed(self, i):
+        self.filter.set_level(self.level_cb.itemData(i))
+        self.view.scrollToBottom()
+
+    def on_scrolled(self, value):
+        self.follow = value == self.view.verticalScrollBar().maximum()
+
+    def on_range_changed(self, minimum, maximum):
+        if self.follow:
+            self.view.verticalScrollBar().setValue(maximum)
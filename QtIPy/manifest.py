@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import os
+import json
+import hashlib
+import traceback
+
+from datetime import datetime
+
+from .qtcore import *
+from . import utils
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    '''
+    Content hash of a file, read in chunks so large files are not held in memory.
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def replace_file(src, dst):
+    '''
+    Move src over dst in one step, so dst is always either the old or the new file.
+    '''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    elif os.name == 'nt' and os.path.exists(dst):
+        # Python 2 on Windows cannot rename over an existing file
+        os.remove(dst)
+        os.rename(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def manifest_path(automaton_id):
+    folder = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), 'manifests')
+    utils.mkdir_p(folder)
+    return os.path.join(folder, '%s.json' % automaton_id)
+
+
+class Manifest(object):
+    '''
+    On-disk record of the files an automaton has processed.
+
+    Each entry holds the size, mtime, optional content hash, and the result of the
+    last run for a file path. A file is due for processing if it is not in the
+    manifest, its last run failed, or it has changed since. When use_hash is set a
+    changed size/mtime is checked against the content hash before the file is
+    considered changed, so touched-but-identical files are skipped.
+
+    Methods may be called from several run threads at once.
+    '''
+
+    def __init__(self, path, use_hash=False):
+        self.path = path
+        self.use_hash = use_hash
+
+        self.mutex = QMutex()
+        self.entries = {}
+        self.pending = {}  # Fingerprints taken when a file was selected, recorded after its run
+        self.seen = set()  # Paths checked since the last save; those are known to exist
+        self.is_dirty = False
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (IOError, OSError):
+            self.entries = {}
+        except ValueError:
+            logging.warning("Manifest %s is corrupt; reprocessing all files" % self.path)
+            self.entries = {}
+
+    def save(self):
+        with QMutexLocker(self.mutex):
+            seen, self.seen = self.seen, set()
+            if not self.is_dirty:
+                return
+            unseen = [p for p in self.entries if p not in seen]
+
+        # Forget files that have since been removed, so the manifest does not grow forever. Only those
+        # the last selection did not see can have gone; they are checked without holding up run threads
+        gone = [p for p in unseen if not os.path.exists(p)]
+
+        with QMutexLocker(self.mutex):
+            for path in gone:
+                self.entries.pop(path, None)
+            data = json.dumps(self.entries)
+            self.is_dirty = False
+
+        # Write to a temporary file and move over, so a crash cannot leave half a manifest
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            replace_file(tmp_path, self.path)
+        except (IOError, OSError):
+            logging.error("Could not write manifest %s:\n%s" % (self.path, traceback.format_exc()))
+
+    def clear(self):
+        with QMutexLocker(self.mutex):
+            self.entries = {}
+            self.pending = {}
+            self.seen = set()
+            self.is_dirty = True
+
+    def is_changed(self, path, st=None):
+        '''
+        Return True if path should be processed, remembering its current fingerprint.
+        st may be given if the file's stat is already to hand.
+        '''
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return False
+
+        fingerprint = {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+        }
+
+        with QMutexLocker(self.mutex):
+            self.seen.add(path)
+            entry = self.entries.get(path)
+
+        changed = entry is None or not entry.get('success') or \
+            entry['size'] != fingerprint['size'] or entry['mtime'] != fingerprint['mtime']
+
+        if changed and self.use_hash:
+            try:
+                fingerprint['hash'] = file_hash(path)
+            except (IOError, OSError):
+                return False
+
+            if entry is not None and entry.get('success') and entry.get('hash') == fingerprint['hash']:
+                # Same content; update the stored stat so we don't hash it next time
+                with QMutexLocker(self.mutex):
+                    entry.update(fingerprint)
+                    self.is_dirty = True
+                changed = False
+
+        if changed:
+            with QMutexLocker(self.mutex):
+                self.pending[path] = fingerprint
+
+        return changed
+
+    def record(self, path, success):
+        with QMutexLocker(self.mutex):
+            entry = self.pending.pop(path, None)
+            if entry is None:
+                return
+            entry['success'] = success
+            entry['timestamp'] = datetime.now().isoformat()
+            self.entries[path] = entry
+            self.is_dirty = True
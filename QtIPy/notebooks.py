@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import os
+
+from collections import OrderedDict
+
+from .qtcore import *
+
+SETUP_TAG = 'setup'
+
+
+def is_setup_cell(cell):
+    '''
+    Setup cells are tagged in the cell metadata, either as {"tags": ["setup"]} or
+    {"qtipy": "setup"}.
+    '''
+    metadata = cell.get('metadata', {})
+    return SETUP_TAG in metadata.get('tags', []) or metadata.get('qtipy') == SETUP_TAG
+
+
+def strip_outputs(nb):
+    '''
+    Remove stored outputs from code cells; they are replaced when the notebook runs.
+    '''
+    for ws in nb.get('worksheets', []):
+        for cell in ws.get('cells', []):
+            if cell.get('cell_type') == 'code':
+                cell['outputs'] = []
+                cell.pop('prompt_number', None)
+    return nb
+
+
+def copy_notebook(nb):
+    '''
+    Copy a notebook deep enough for a run to modify it.
+
+    The runner inserts cells and replaces cell outputs and prompt numbers, so the
+    notebook, worksheets, cell lists and cells are copied; cell contents (sources,
+    outputs) are shared with the original.
+    '''
+    from IPython.nbformat.current import NotebookNode
+
+    nb = NotebookNode(nb)
+    nb['worksheets'] = [NotebookNode(ws) for ws in nb.get('worksheets', [])]
+    for ws in nb['worksheets']:
+        ws['cells'] = [NotebookNode(cell) for cell in ws.get('cells', [])]
+    return nb
+
+
+class NotebookCache(object):
+    '''
+    Parsed notebooks keyed by path, re-read only when the file's mtime or size
+    changes. Each get() returns a private copy so concurrent runs are isolated.
+
+    Holds up to max_size notebooks, dropping the least recently used.
+    '''
+
+    def __init__(self, max_size=64):
+        self.mutex = QMutex()
+        self.cache = OrderedDict()
+        self.max_size = max_size
+
+    def get(self, path, strip=False):
+        st = os.stat(path)
+        key = (path, strip)
+        stamp = (st.st_mtime, st.st_size)
+
+        with QMutexLocker(self.mutex):
+            entry = self.cache.pop(key, None)
+            if entry is not None and entry[0] == stamp:
+                self.cache[key] = entry  # Most recently used last
+                return copy_notebook(entry[1])
+
+        from IPython.nbformat.current import reads
+
+        with open(path) as f:
+            nb = reads(f.read(), 'json')
+
+        if strip:
+            strip_outputs(nb)
+
+        with QMutexLocker(self.mutex):
+            self.cache[key] = (stamp, nb)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+        logging.debug('Loaded notebook %s' % path)
+        return copy_notebook(nb)
+
+    def clear(self):
+        with QMutexLocker(self.mutex):
+            self.cache.clear()
+
+
+_cache = None
+
+
+def get_notebook_cache():
+    '''
+    Return the shared notebook cache, creating it on first use.
+    '''
+    global _cache
+    if _cache is None:
+        _cache = NotebookCache()
+    return _cache
@@ -0,0 +1,6 @@
+import sys
+
+# Non-GUI Qt classes only, for the engine modules: importing these does not load
+# the GUI libraries, so headless and command-line use stays light
+from PyQt5.QtCore import *
+from PyQt5.QtNetwork import *
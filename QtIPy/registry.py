@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+
+class AutomatonRegistry(object):
+    '''
+    Ordered set of automatons, with constant-time lookup of an automaton's row.
+
+    The list order is the display order; the GUI list model and the headless
+    daemon both keep their automatons here.
+    '''
+
+    def __init__(self):
+        self.automatons = []
+        self.rows = {}  # id(automaton) -> row
+
+    def __len__(self):
+        return len(self.automatons)
+
+    def __iter__(self):
+        return iter(self.automatons)
+
+    def __getitem__(self, row):
+        return self.automatons[row]
+
+    def add(self, automaton):
+        self.rows[id(automaton)] = len(self.automatons)
+        self.automatons.append(automaton)
+        return self.rows[id(automaton)]
+
+    def remove(self, row):
+        automaton = self.automatons.pop(row)
+        del self.rows[id(automaton)]
+        for r in range(row, len(self.automatons)):
+            self.rows[id(self.automatons[r])] = r
+        return automaton
+
+    def clear(self):
+        self.automatons = []
+        self.rows = {}
+
+    def row(self, automaton):
+        return self.rows.get(id(automaton))
+
+    def find(self, id):
+        '''
+        Return the automaton with the given automaton_id or list index, or None.
+        '''
+        for automaton in self.automatons:
+            if automaton.config.get('automaton_id') == id:
+                return automaton
+        try:
+            return self.automatons[int(id)]
+        except (TypeError, ValueError, IndexError):
+            return None
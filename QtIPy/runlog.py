@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import io
+import os
+import gzip
+import json
+import time
+import shutil
+import threading
+import traceback
+
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from .qtcore import *
+from . import utils
+
+# Log file for records logged outside of any run
+APP_LOG = 'qtipy'
+
+_context = threading.local()
+
+
+def new_run_id():
+    return datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+
+def current_run():
+    '''
+    Return (automaton_id, run_id) for the run on this thread, or (None, None).
+    '''
+    return getattr(_context, 'automaton_id', None), getattr(_context, 'run_id', None)
+
+
+@contextmanager
+def run_context(automaton_id, run_id=None):
+    '''
+    Tag records logged on this thread with the automaton and run, so they are
+    written to that run's log file. Pass the run_id of an existing run to log to
+    it from another (e.g. worker) thread; the run's file is closed when the
+    context that started it exits.
+    '''
+    started = run_id is None
+    if started:
+        run_id = new_run_id()
+
+    previous = current_run()
+    _context.automaton_id, _context.run_id = automaton_id, run_id
+    try:
+        yield run_id
+    finally:
+        _context.automaton_id, _context.run_id = previous
+        if started and _sink is not None:
+            _sink.close_run(automaton_id, run_id)
+
+
+class RunLogHandler(logging.Handler):
+    '''
+    Logging handler that passes records to a RunLogSink.
+
+    emit() only builds the JSON-able entry (on the logging thread, while the
+    record's arguments and traceback are still valid) and queues it; it never
+    waits on disk.
+    '''
+
+    def __init__(self, sink):
+        super(RunLogHandler, self).__init__()
+        self.sink = sink
+
+    def emit(self, record):
+        try:
+            automaton_id, run_id = current_run()
+            entry = {
+                'time': datetime.fromtimestamp(record.created).isoformat(),
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage(),
+            }
+            if record.exc_info:
+                entry['exc'] = ''.join(traceback.format_exception(*record.exc_info))
+            if run_id is not None:
+                entry['automaton'] = automaton_id
+                entry['run'] = run_id
+
+            self.sink.queue.put((automaton_id, run_id, entry))
+        except Exception:
+            self.handleError(record)
+
+
+class RunLogSink(object):
+    '''
+    Writes queued log entries as JSON lines, one file per automaton run:
+
+        <path>/<automaton_id>/<run_id>.jsonl
+
+    and records from outside a run to <path>/qtipy.jsonl. A file is rotated once
+    it is larger than max_bytes or older than max_age seconds; rotated segments
+    are gzipped as <name>.<n>.jsonl.gz. Files older than keep_days are removed.
+    All file work happens on a single writer thread.
+    '''
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, max_age=24 * 60 * 60, keep_days=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_days = keep_days
+
+        self.queue = Queue()
+        self.files = {}  # (automaton_id, run_id) -> [file, size, opened, segment]
+        self.last_pruned = 0
+
+        utils.mkdir_p(self.path)
+
+        self.thread = threading.Thread(target=self._work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close_run(self, automaton_id, run_id):
+        self.queue.put((automaton_id, run_id, None))
+
+    def _filename(self, automaton_id, run_id, segment=None):
+        if run_id is None:
+            folder, name = self.path, APP_LOG
+        else:
+            folder, name = os.path.join(self.path, automaton_id or 'unknown'), run_id
+
+        if segment is None:
+            return os.path.join(folder, '%s.jsonl' % name)
+        return os.path.join(folder, '%s.%d.jsonl.gz' % (name, segment))
+
+    def _open(self, key):
+        filename = self._filename(*key)
+        utils.mkdir_p(os.path.dirname(filename))
+        f = io.open(filename, 'a', encoding='utf-8')
+        # Continue numbering after segments left by an earlier process
+        segment = 1
+        while os.path.exists(self._filename(key[0], key[1], segment)):
+            segment += 1
+        self.files[key] = [f, f.tell(), time.time(), segment]
+        return self.files[key]
+
+    def _close(self, key):
+        entry = self.files.pop(key, None)
+        if entry is not None:
+            entry[0].close()
+
+    def _rotate(self, key):
+        f, size, opened, segment = self.files[key]
+        f.close()
+
+        filename = self._filename(*key)
+        with open(filename, 'rb') as fin:
+            with gzip.open(self._filename(key[0], key[1], segment), 'wb') as fout:
+                shutil.copyfileobj(fin, fout)
+        os.remove(filename)
+
+        f = io.open(filename, 'a', encoding='utf-8')
+        self.files[key] = [f, 0, time.time(), segment + 1]
+
+    def _write(self, key, entry):
+        state = self.files.get(key) or self._open(key)
+
+        line = json.dumps(entry, default=str) + '\n'
+        state[0].write(line)
+        state[0].flush()
+        state[1] += len(line)
+
+        if state[1] > self.max_bytes or time.time() - state[2] > self.max_age:
+            self._rotate(key)
+
+    def prune(self):
+        # Remove log files not modified in keep_days
+        cutoff = time.time() - self.keep_days * 24 * 60 * 60
+        open_files = set(self._filename(*key) for key in self.files)
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+                if filename not in open_files and os.path.getmtime(filename) < cutoff:
+                    os.remove(filename)
+        self.last_pruned = time.time()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    for key in list(self.files.keys()):
+                        self._close(key)
+                    break
+
+                automaton_id, run_id, entry = item
+                if entry is None:
+                    self._close((automaton_id, run_id))
+                else:
+                    self._write((automaton_id, run_id), entry)
+
+                if time.time() - self.last_pruned > 60 * 60:
+                    self.prune()
+
+            except (IOError, OSError):
+                # Can't log this through logging; it would come straight back here
+                traceback.print_exc()
+
+            finally:
+                self.queue.task_done()
+
+    def shutdown(self):
+        '''
+        Write all queued entries, close the files and stop the writer.
+        '''
+        self.queue.put(None)
+        self.thread.join()
+
+
+_sink = None
+_handler = None
+
+
+def get_run_log_path():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), 'logs')
+
+
+def install_run_log(level=logging.DEBUG):
+    '''
+    Start writing log records to disk, by adding a RunLogHandler to the root logger.
+    Requires the application (organisation and name) to be set up first.
+    '''
+    global _sink, _handler
+    if _sink is None:
+        _sink = RunLogSink(get_run_log_path())
+        _handler = RunLogHandler(_sink)
+        _handler.setLevel(level)
+        logging.getLogger().addHandler(_handler)
+    return _sink
+
+
+def configure_run_log(max_bytes, keep_days):
+    if _sink is not None:
+        _sink.max_bytes = max_bytes
+        _sink.keep_days = keep_days
+
+
+def shutdown_run_log():
+    global _sink, _handler
+    if _sink is not None:
+        logging.getLogger().removeHandler(_handler)
+        _sink.shutdown()
+        _sink = _handler = None
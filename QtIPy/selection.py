@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+import heapq
+import fnmatch
+
+from itertools import islice
+
+from .watchers import iter_files
+
+SORT_NONE = ''
+SORT_NAME = 'name'
+SORT_MTIME = 'mtime'
+SORT_SIZE = 'size'
+
+_sort_keys = {
+    SORT_NAME: lambda entry: entry.path,
+    SORT_MTIME: lambda entry: entry.stat().st_mtime,
+    SORT_SIZE: lambda entry: entry.stat().st_size,
+}
+
+
+def entry_stat(entry):
+    '''
+    Return the (usually cached) stat of a DirEntry, or None if the file has gone.
+    '''
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+
+def split_patterns(patterns):
+    '''
+    Patterns are given as a list, or as one string separated by ';'.
+    '''
+    if not patterns:
+        return []
+    if not isinstance(patterns, (list, tuple)):
+        patterns = patterns.split(';')
+    return [p.strip() for p in patterns if p and p.strip()]
+
+
+def compile_globs(patterns):
+    '''
+    Compile glob patterns into a single regex. A pattern without any wildcard is
+    taken as a file extension ('.csv') or, failing that, part of the name, as the
+    old substring wildcard was.
+    '''
+    translated = []
+    for p in split_patterns(patterns):
+        if not any(c in p for c in '*?['):
+            p = '*' + p if p.startswith('.') else '*' + p + '*'
+        translated.append(fnmatch.translate(p))
+
+    if not translated:
+        return None
+    return re.compile('|'.join('(?:%s)' % t for t in translated))
+
+
+class FileSelector(object):
+    '''
+    Chooses the files in a folder tree that a run works on.
+
+    A file is selected if its name matches one of patterns (globs; all files if
+    none), its path relative to the root matches regex (if given), neither name nor
+    relative path matches an exclude glob, and it is within the size and age
+    limits. Sizes are in bytes and ages in seconds; 0 or None for no limit.
+
+    select() streams the matching DirEntry objects, reusing their stat data. With
+    a sort, at most limit entries are held in memory.
+    '''
+
+    def __init__(self, patterns=None, regex=None, exclude=None, min_size=None, max_size=None, max_age=None,
+                 sort=SORT_NONE, reverse=False, limit=None):
+        self.patterns = compile_globs(patterns)
+        self.regex = re.compile(regex) if regex else None
+        self.exclude = compile_globs(exclude)
+        self.min_size = min_size or None
+        self.max_size = max_size or None
+        self.max_age = max_age or None
+        self.sort = sort
+        self.reverse = reverse
+        self.limit = limit or None
+
+    def match_name(self, root, path):
+        # Name tests only; used for watcher events, where no stat is to hand
+        name = os.path.basename(path)
+        if self.patterns is not None and not self.patterns.match(name):
+            return False
+
+        if self.regex is not None or self.exclude is not None:
+            relpath = os.path.relpath(path, root).replace(os.sep, '/')
+            if self.regex is not None and not self.regex.search(relpath):
+                return False
+            if self.exclude is not None and (self.exclude.match(name) or self.exclude.match(relpath)):
+                return False
+
+        return True
+
+    def match_stat(self, st, now):
+        if self.min_size is not None and st.st_size < self.min_size:
+            return False
+        if self.max_size is not None and st.st_size > self.max_size:
+            return False
+        if self.max_age is not None and now - st.st_mtime > self.max_age:
+            return False
+        return True
+
+    def _filter(self, root, depth):
+        root = os.path.abspath(root)
+        # Sorting by mtime or size needs the stat too; fetched once, it stays on the entry
+        stats = self.min_size is not None or self.max_size is not None or self.max_age is not None or \
+            self.sort in (SORT_MTIME, SORT_SIZE)
+        now = time.time()
+        for entry in iter_files(root, depth):
+            if not self.match_name(root, entry.path):
+                continue
+            if stats:
+                st = entry_stat(entry)
+                if st is None or not self.match_stat(st, now):
+                    continue
+            yield entry
+
+    def select(self, root, depth=None):
+        '''
+        Yield a DirEntry for each selected file in root, down to depth levels of
+        subfolders (None for all).
+        '''
+        entries = self._filter(root, depth)
+        if not self.sort:
+            return islice(entries, self.limit)
+
+        key = _sort_keys[self.sort]
+        if self.limit is not None:
+            # Only the best limit entries are kept as the tree is listed
+            choose = heapq.nlargest if self.reverse else heapq.nsmallest
+            return iter(choose(self.limit, entries, key=key))
+
+        return iter(sorted(entries, key=key, reverse=self.reverse))
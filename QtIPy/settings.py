@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .qtcore import *
+from .engine import get_engine
+from .kernels import get_kernel_pool
+from .cellcache import get_cell_cache
+from .runlog import configure_run_log
+from .configstore import CachedSettingsManager
+
+
+# Application-wide settings, shared by the GUI and the headless daemon
+SETTINGS_DEFAULTS = {
+    'max_concurrent_runs': QThread.idealThreadCount(),
+    'min_kernels': 1,
+    'max_kernels': QThread.idealThreadCount(),
+    'kernel_idle_timeout': 300,
+    'cell_cache_size': 256,
+    'log_retention': 100000,
+    'run_log_size': 10,
+    'run_log_keep_days': 30,
+}
+
+_settings = None
+
+
+def get_settings():
+    '''
+    Return the application settings, creating them on first use. Requires the
+    application (organisation and name) to be set up first.
+    '''
+    global _settings
+    if _settings is None:
+        _settings = CachedSettingsManager()
+        _settings.set_defaults(SETTINGS_DEFAULTS)
+    return _settings
+
+
+def apply_settings():
+    '''
+    Configure the execution engine, kernel pool and caches from the settings.
+    '''
+    settings = get_settings()
+    get_engine().set_max_concurrent(settings.get('max_concurrent_runs'))
+    get_kernel_pool().configure(
+        settings.get('min_kernels'),
+        settings.get('max_kernels'),
+        settings.get('kernel_idle_timeout'),
+    )
+    get_cell_cache().max_size = settings.get('cell_cache_size') * 1024 * 1024
+    configure_run_log(settings.get('run_log_size') * 1024 * 1024, settings.get('run_log_keep_days'))
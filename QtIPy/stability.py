@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import time
+
+from .qtcore import *
+
+
+class StabilityGate(QObject):
+    '''
+    Holds back changed files until they have finished being written.
+
+    A file is released once its size and mtime have not changed for quiet
+    seconds or, if on_close is set, as soon as it is reported closed after
+    writing. Files that are removed while held are dropped. released is emitted
+    with lists of paths, and at most once per check for files released by age.
+
+    With quiet set to 0 files are only held for on_close, until they are closed;
+    without on_close either, they are released straight away. on_close should
+    only be set where closes are reported. Must be used from the thread it
+    belongs to.
+    '''
+
+    released = pyqtSignal(list)
+
+    def __init__(self, quiet=0, on_close=True, *args, **kwargs):
+        super(StabilityGate, self).__init__(*args, **kwargs)
+        self.quiet = quiet
+        self.on_close = on_close
+        self.pending = {}  # path -> ((size, mtime), time last seen to change)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.check)
+
+    def configure(self, quiet, on_close):
+        self.quiet = quiet
+        self.on_close = on_close
+        self.clear()
+
+    def clear(self):
+        self.pending = {}
+        self.timer.stop()
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def add(self, changes):
+        '''
+        Take a list of (path, closed) pairs: closed is True if the file is known
+        to be complete, e.g. it was closed after writing or moved into place.
+        '''
+        released = []
+        now = time.time()
+        for path, closed in changes:
+            if (closed and self.on_close) or (self.quiet <= 0 and not self.on_close):
+                self.pending.pop(path, None)
+                released.append(path)
+                continue
+
+            state = self._stat(path)
+            if state is None:
+                self.pending.pop(path, None)
+            elif path not in self.pending or self.pending[path][0] != state:
+                self.pending[path] = (state, now)
+
+        if self.pending and self.quiet > 0 and not self.timer.isActive():
+            # Check often enough that files are released within a quarter of the quiet period
+            self.timer.start(max(100, int(self.quiet * 1000 / 4)))
+
+        if released:
+            self.released.emit(released)
+
+    def discard(self, path):
+        self.pending.pop(path, None)
+
+    def holding(self):
+        # Files still being written; runs should leave them for later
+        return set(self.pending)
+
+    def check(self):
+        released = []
+        now = time.time()
+        for path, (state, since) in list(self.pending.items()):
+            current = self._stat(path)
+            if current is None:
+                del self.pending[path]
+            elif current != state:
+                self.pending[path] = (current, now)
+            elif now - since >= self.quiet:
+                del self.pending[path]
+                released.append(path)
+
+        if not self.pending:
+            self.timer.stop()
+
+        if released:
+            self.released.emit(released)
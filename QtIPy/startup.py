@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sys
+import time
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+_profile = None
+
+
+class StartupProfile(object):
+    '''
+    Records where startup time goes: time spent importing each top-level package
+    and the time at which each startup milestone was reached.
+
+    Imports are timed by wrapping __import__. Each package is charged only for its
+    own time: nested imports of other packages are charged to those packages.
+    '''
+
+    def __init__(self):
+        self.t0 = time.time()
+        self.imports = {}
+        self.marks = []
+        self.stack = []  # [package, time spent in nested imports] per import in progress
+
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Relative imports are from within the package
+        package = 'QtIPy' if level > 0 else name.split('.')[0]
+        frame = [package, 0]
+        self.stack.append(frame)
+
+        t = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - t
+            self.stack.pop()
+            self.imports[package] = self.imports.get(package, 0) + elapsed - frame[1]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def mark(self, label):
+        self.marks.append((label, time.time() - self.t0))
+
+    def stop(self):
+        builtins.__import__ = self._import
+
+    def report(self, limit=15):
+        lines = ['Startup profile:']
+        for label, t in self.marks:
+            lines.append('  %8.1f ms  %s' % (t * 1000, label))
+
+        lines.append('Slowest imports:')
+        for package, t in sorted(self.imports.items(), key=lambda i: -i[1])[:limit]:
+            lines.append('  %8.1f ms  %s' % (t * 1000, package))
+
+        return '\n'.join(lines)
+
+
+def enable():
+    '''
+    Start profiling; call before anything else is imported.
+    '''
+    global _profile
+    if _profile is None:
+        _profile = StartupProfile()
+
+
+def mark(label):
+    if _profile is not None:
+        _profile.mark(label)
+
+
+def report():
+    '''
+    Mark startup as complete, stop timing imports and write the report to stderr.
+    '''
+    global _profile
+    if _profile is None:
+        return
+
+    _profile.mark('ready')
+    _profile.stop()
+    sys.stderr.write(_profile.report() + '\n')
+    _profile = None
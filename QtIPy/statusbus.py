@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from .qtcore import *
+
+# Views are refreshed at most this often
+STATUS_INTERVAL = 33  # ms, ~30 Hz
+
+
+class StatusBus(QObject):
+    '''
+    Collects automaton state changes and passes them on in batches.
+
+    publish() may be called from any thread, as often as state changes. Changed
+    automatons are collected and changed is emitted, on the GUI thread, with the
+    list of automatons changed since the last emit; at most once per interval.
+    '''
+
+    changed = pyqtSignal(list)
+    _wake = pyqtSignal()
+
+    def __init__(self, interval=STATUS_INTERVAL, *args, **kwargs):
+        super(StatusBus, self).__init__(*args, **kwargs)
+
+        self.interval = interval
+        self.mutex = QMutex()
+        self.pending = {}  # id(automaton) -> automaton
+        self.last_flush = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+        app = QCoreApplication.instance()
+        if app is not None:
+            # Timers, and so flushes, run on the GUI thread wherever we were created
+            self.moveToThread(app.thread())
+
+        self._wake.connect(self.schedule, Qt.QueuedConnection)
+
+    def publish(self, automaton):
+        with QMutexLocker(self.mutex):
+            wake = not self.pending
+            self.pending[id(automaton)] = automaton
+
+        # Only the first change in a batch needs to schedule the flush
+        if wake:
+            self._wake.emit()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            since = (time.time() - self.last_flush) * 1000
+            self.timer.start(max(0, int(self.interval - since)))
+
+    def flush(self):
+        with QMutexLocker(self.mutex):
+            automatons = list(self.pending.values())
+            self.pending = {}
+
+        self.last_flush = time.time()
+        if automatons:
+            self.changed.emit(automatons)
+
+
+_bus = None
+
+
+def get_status_bus():
+    '''
+    Return the shared status bus, creating it on first use.
+    '''
+    global _bus
+    if _bus is None:
+        _bus = StatusBus()
+    return _bus
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from .qt import QCoreApplication
+from .qtcore import QCoreApplication
 
 
 def tr(s, *args, **kwargs):
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+import os
+import sys
+import errno
+import struct
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from .qtcore import *
+
+# Kinds of folder event, reported as (kind, path) pairs
+EVENT_CREATED = 'created'
+EVENT_MODIFIED = 'modified'
+EVENT_CLOSED = 'closed'  # Closed after writing, so complete for now (inotify only)
+EVENT_MOVED = 'moved'  # Moved into (or within) the watched tree; path is the new location
+EVENT_DELETED = 'deleted'
+EVENT_OVERFLOW = 'overflow'  # Events were lost; path is the root, anything below may have changed
+
+BACKEND_AUTO = 'auto'
+BACKEND_INOTIFY = 'inotify'
+BACKEND_POLLING = 'polling'
+
+DEFAULT_POLL_INTERVAL = 2  # secs
+
+
+class WatcherError(Exception):
+    pass
+
+
+def iter_dirs(root, depth=None):
+    '''
+    Yield (path, level) for root and the folders below it, down to depth levels
+    (None for no limit). Symlinked folders are not followed.
+    '''
+    stack = [(root, 0)]
+    while stack:
+        path, level = stack.pop()
+        yield path, level
+
+        if depth is not None and level >= depth:
+            continue
+
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, level + 1))
+            except OSError:
+                continue
+
+
+def iter_files(root, depth=None):
+    '''
+    Yield a DirEntry for each regular file in root and, down to depth levels,
+    the folders below it. Entries are produced as folders are read, so callers
+    can start before the whole tree has been listed.
+    '''
+    for path, level in iter_dirs(root, depth):
+        try:
+            entries = scandir(path)
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    yield entry
+            except OSError:
+                continue
+
+
+class FolderWatcher(QObject):
+    '''
+    Watches a folder tree and reports changes to the files in it.
+
+    events is emitted on the thread the watcher belongs to, with a list of
+    (kind, path) pairs; changes close together in time arrive in one list. depth
+    limits how many levels of subfolders are watched: 0 for the folder itself
+    only, None for the whole tree. reports_close is set on watchers that report
+    EVENT_CLOSED.
+    '''
+
+    events = pyqtSignal(list)
+    reports_close = False
+
+    def __init__(self, path, depth=None, *args, **kwargs):
+        super(FolderWatcher, self).__init__(*args, **kwargs)
+        self.path = os.path.abspath(path)
+        self.depth = depth
+        self.active = False
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def _emit(self, events):
+        if events and self.active:
+            self.events.emit(events)
+
+
+class PollingWatcher(FolderWatcher):
+    '''
+    Portable watcher: lists the tree every interval seconds and diffs the listing
+    against the previous one. A file that disappears and reappears elsewhere with
+    the same inode is reported as moved.
+
+    Listing runs on a background thread, so large trees do not hold up the GUI;
+    the cost is one stat per file per interval.
+    '''
+
+    def __init__(self, path, depth=None, interval=DEFAULT_POLL_INTERVAL, *args, **kwargs):
+        super(PollingWatcher, self).__init__(path, depth, *args, **kwargs)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def snapshot(self):
+        files = {}
+        for entry in iter_files(self.path, self.depth):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files[entry.path] = (st.st_size, st.st_mtime, st.st_ino)
+        return files
+
+    def diff(self, old, new):
+        events = []
+        removed = dict((st[2], path) for path, st in old.items() if path not in new)
+        for path, st in new.items():
+            previous = old.get(path)
+            if previous is None:
+                if removed.pop(st[2], None) is not None:
+                    events.append((EVENT_MOVED, path))
+                else:
+                    events.append((EVENT_CREATED, path))
+            elif previous != st:
+                events.append((EVENT_MODIFIED, path))
+
+        events.extend((EVENT_DELETED, path) for path in removed.values())
+        return events
+
+    def _work(self, stopped):
+        files = self.snapshot()
+        while not stopped.wait(self.interval):
+            current = self.snapshot()
+            events = self.diff(files, current)
+            files = current
+            # Emitted from this thread, so delivered to the watcher's thread as a queued call
+            if not stopped.is_set():
+                self._emit(events)
+
+    def start(self):
+        super(PollingWatcher, self).start()
+        # Each start gets its own event, so a thread still finishing a scan stops too
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._work, args=(self.stopped, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        super(PollingWatcher, self).stop()
+        self.stopped.set()
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; followed by len bytes of name
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def inotify_available():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class InotifyWatcher(FolderWatcher):
+    '''
+    Linux watcher using inotify directly, with one watch per folder (rather than
+    per file) so trees of many thousands of files stay cheap. Folders created in
+    or moved into the tree are watched as they appear, and files already in them
+    are reported.
+
+    Reads are driven by a QSocketNotifier on the watcher's thread. Raises
+    WatcherError from start() if the tree cannot be watched, e.g. because the
+    fs.inotify.max_user_watches limit has been reached.
+    '''
+
+    reports_close = True
+
+    def __init__(self, path, depth=None, *args, **kwargs):
+        super(InotifyWatcher, self).__init__(path, depth, *args, **kwargs)
+        self.fd = None
+        self.notifier = None
+        self.wds = {}  # wd -> folder path
+        self.levels = {}  # folder path -> (wd, level below the root)
+
+    def _add_watch(self, path, level):
+        import ctypes
+        wd = _get_libc().inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding()), INOTIFY_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatcherError('inotify watch limit reached watching %s; raise fs.inotify.max_user_watches' % path)
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return  # Gone, or not ours to watch
+            raise WatcherError('Could not watch %s: %s' % (path, os.strerror(err)))
+
+        self.wds[wd] = path
+        self.levels[path] = (wd, level)
+
+    def _add_tree(self, path, level):
+        depth = None if self.depth is None else self.depth - level
+        for p, l in iter_dirs(path, depth):
+            self._add_watch(p, level + l)
+
+    def _forget(self, wd):
+        path = self.wds.pop(wd, None)
+        if path is not None and self.levels.get(path, (None, ))[0] == wd:
+            del self.levels[path]
+
+    def _remove_tree(self, path):
+        # The folder has left the tree; its watches (and those below it) now point elsewhere
+        prefix = path + os.sep
+        for p in [p for p in self.levels if p == path or p.startswith(prefix)]:
+            wd, _ = self.levels.pop(p)
+            self.wds.pop(wd, None)
+            _get_libc().inotify_rm_watch(self.fd, wd)
+
+    def start(self):
+        fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            import ctypes
+            raise WatcherError('Could not start inotify: %s' % os.strerror(ctypes.get_errno()))
+        self.fd = fd
+
+        try:
+            self._add_tree(self.path, 0)
+        except WatcherError:
+            self.stop()
+            raise
+
+        self.notifier = QSocketNotifier(self.fd, QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.read_events)
+        super(InotifyWatcher, self).start()
+
+    def stop(self):
+        super(InotifyWatcher, self).stop()
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.wds = {}
+        self.levels = {}
+
+    def read_events(self, *args):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+
+        events = []
+        seen = set()
+
+        def add(kind, path):
+            if (kind, path) not in seen:
+                seen.add((kind, path))
+                events.append((kind, path))
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(sys.getfilesystemencoding(), 'replace')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                add(EVENT_OVERFLOW, self.path)
+                continue
+
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+
+            folder = self.wds.get(wd)
+            if folder is None:
+                continue
+            path = os.path.join(folder, name) if name else folder
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    level = self.levels[folder][1] + 1
+                    if self.depth is None or level <= self.depth:
+                        try:
+                            self._add_tree(path, level)
+                        except WatcherError as e:
+                            logging.warning('%s' % e)
+                        # Files may have arrived before the watch was in place
+                        kind = EVENT_CREATED if mask & IN_CREATE else EVENT_MOVED
+                        depth = None if self.depth is None else self.depth - level
+                        for entry in iter_files(path, depth):
+                            add(kind, entry.path)
+
+                elif mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+
+            elif mask & IN_CREATE:
+                add(EVENT_CREATED, path)
+            elif mask & IN_CLOSE_WRITE:
+                add(EVENT_CLOSED, path)
+            elif mask & IN_MODIFY:
+                add(EVENT_MODIFIED, path)
+            elif mask & IN_MOVED_TO:
+                add(EVENT_MOVED, path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                add(EVENT_DELETED, path)
+
+        self._emit(events)
+
+
+def create_folder_watcher(path, backend=BACKEND_AUTO, depth=None, interval=DEFAULT_POLL_INTERVAL, parent=None):
+    '''
+    Create and start a watcher for path. With BACKEND_AUTO inotify is used where
+    available, falling back to polling if it is not or cannot watch the tree.
+    '''
+    if backend in (BACKEND_AUTO, BACKEND_INOTIFY) and inotify_available():
+        watcher = InotifyWatcher(path, depth, parent)
+        try:
+            watcher.start()
+        except WatcherError as e:
+            logging.warning('%s; polling instead' % e)
+        else:
+            return watcher
+
+    watcher = PollingWatcher(path, depth, interval, parent)
+    watcher.start()
+    return watcher
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from collections import deque
+
+
+class WatchWindow(object):
+    '''
+    Decides when changes to a set of watched files add up to a trigger: once
+    required of them (all, if 0 or None) have changed within window seconds.
+
+    Changes are kept in arrival order in a deque, so those that have fallen out
+    of the window are dropped from the front; seen maps each file to the time of
+    its latest change in the window. An older deque entry for a file changed
+    again is skipped when it expires, and the deque is rebuilt from seen if such
+    entries pile up (a long window with busy files). Each change then costs
+    O(log n) amortised, however many files are watched.
+    '''
+
+    def __init__(self, paths, window, required=None):
+        self.watched = frozenset(paths)
+        self.window = window
+        self.required = min(required or len(self.watched), len(self.watched))
+
+        self.changes = deque()  # (time, path), oldest first
+        self.seen = {}  # path -> time of its latest change in the window
+
+    def expire(self, now):
+        cutoff = now - self.window
+        changes, seen = self.changes, self.seen
+        while changes and changes[0][0] <= cutoff:
+            t, path = changes.popleft()
+            if seen.get(path) == t:
+                del seen[path]
+
+    def add(self, path, now=None):
+        '''
+        Record a change to path. Returns the changed files if they now make a
+        trigger, and starts a new window; otherwise None.
+        '''
+        if path not in self.watched:
+            return None
+
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        self.seen[path] = now
+        self.changes.append((now, path))
+        if len(self.changes) > 4 * len(self.watched):
+            self.changes = deque(sorted((t, p) for p, t in self.seen.items()))
+
+        if len(self.seen) < self.required:
+            return None
+
+        paths = list(self.seen)
+        self.clear()
+        return paths
+
+    def clear(self):
+        self.changes.clear()
+        self.seen = {}
@@ -32,6 +32,7 @@ setup(
     install_requires=[
         'pyqtconfig>=0.1',
         'runipy>=0.0.9',
+        'scandir; python_version < "3.5"',
             ],
 
     keywords='bioinformatics research analysis science',